@@ -0,0 +1,36 @@
+# Confronta il costo di parsing per riga tra i modelli completi Wellness
+# e i modelli ridotti usati dai job di sincronizzazione.
+# Uso (dalla cartella services): python -m benchmarks.dataset_parse [righe]
+import sys
+import timeit
+import typing
+from pydantic import BaseModel
+from models.customerResponse import DataSetItem as CustomerDataSetItem, CustomerSyncItem
+from models.salesResponse import DataSetItem as SalesDataSetItem, SalesSyncItem
+
+SAMPLES = {str: "2025-01-01T00:00:00", int: 1, float: 1.0, bool: True}
+
+def sample_row(model: type[BaseModel]) -> dict:
+    row = {}
+    for name, field in model.model_fields.items():
+        types = typing.get_args(field.annotation) or (field.annotation,)
+        row[name] = next((SAMPLES[t] for t in types if t in SAMPLES), None)
+    return row
+
+def per_row_us(model: type[BaseModel], rows: list[dict]) -> float:
+    seconds = min(timeit.repeat(lambda: [model.model_validate(row) for row in rows], number=1, repeat=5))
+    return seconds / len(rows) * 1_000_000
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    for label, full, lean in [
+        ("customers", CustomerDataSetItem, CustomerSyncItem),
+        ("sales", SalesDataSetItem, SalesSyncItem),
+    ]:
+        rows = [sample_row(full) for _ in range(count)]
+        before = per_row_us(full, rows)
+        after = per_row_us(lean, rows)
+        print(f"{label}: {before:.2f} us/row -> {after:.2f} us/row ({before / after:.1f}x)")
+
+if __name__ == "__main__":
+    main()
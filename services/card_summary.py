@@ -0,0 +1,270 @@
+import asyncio
+import os
+from datetime import date, datetime
+from typing import Iterable, Optional
+from uuid import uuid4
+from postgrest import ReturnMethod
+from postgrest.exceptions import APIError
+from dotenv import load_dotenv
+from database import supabase, execute, bulk_upsert
+
+load_dotenv()
+
+# Riepilogo schede precalcolato per consulente, anno, mese e tipo abbonamento.
+# Le letture sono lookup sulla tabella CardMonthSummary: una cella mancante o marcata
+# Stale viene calcolata con get_dashboard_summary e salvata; il Month 0 contiene il
+# risultato di get_total_card_summary per l'anno intero.
+# Le scritture su schede e sessioni PT e i job notturni non cancellano le celle ma le
+# marcano Stale con un nuovo Token: un ricalcolo partito prima dell'invalidazione
+# trova il Token cambiato e non lascia il suo dato come valido (vince la scrittura).
+#
+# create table "CardMonthSummary" (
+#     "TrainingOperatorId" int not null,
+#     "Year" int not null,
+#     "Month" int not null,
+#     "Scope" text not null,
+#     "Data" jsonb,
+#     "Stale" boolean not null default false,
+#     "Token" text,
+#     "UpdatedAt" timestamptz not null default now(),
+#     primary key ("TrainingOperatorId", "Year", "Month", "Scope")
+# );
+#
+# Il riepilogo di squadra ricalcola le celle mancanti di tutti i consulenti con una rpc:
+#
+# create function get_team_dashboard_summary(p_months int[], p_year int, p_training_operator_ids int[], p_is_mds boolean)
+# returns jsonb language sql stable as $$
+#     select coalesce(jsonb_agg(to_jsonb(s) || jsonb_build_object('TrainingOperatorId', op)), '[]'::jsonb)
+#     from unnest(p_training_operator_ids) op,
+#          lateral get_dashboard_summary(p_months, p_year, op, p_is_mds) s
+# $$;
+
+SUMMARY_TABLE = 'CardMonthSummary'
+SUMMARY_CONFLICT = 'TrainingOperatorId,Year,Month,Scope'
+ALL_MONTHS = list(range(1, 13))
+# cella con il totale annuo di get_total_card_summary
+TOTAL_MONTH = 0
+# PostgREST (funzione non in schema cache) e Postgres (undefined_function)
+MISSING_FUNCTION_CODES = ('PGRST202', '42883')
+# Numero massimo di rpc di ricalcolo e di invalidazioni contemporanee
+build_concurrency: int = int(os.getenv("CARD_SUMMARY_BUILD_CONCURRENCY", "4"))
+
+class CardSummaryStore:
+    async def get_months(self, operator_id: int, year: int, months: Optional[list[int]], is_mds: Optional[bool]) -> list[dict]:
+        months = sorted(set(months or ALL_MONTHS))
+        cells = await self._get_cells([operator_id], year, months, is_mds)
+
+        # i mesi senza attività restano salvati come cella vuota per non ricalcolarli
+        return [cells[(operator_id, month)] for month in months if cells.get((operator_id, month)) is not None]
+
+    async def get_total(self, operator_id: int, year: int, months: Optional[list[int]], is_mds: Optional[bool]) -> list[dict]:
+        if months and set(months) != set(ALL_MONTHS):
+            # totale su una parte dell'anno: non è precalcolato, uso direttamente la rpc
+            response = await execute(supabase.rpc('get_total_card_summary', {
+                "p_months": sorted(set(months)),
+                "p_year": year,
+                "p_training_operator_id": operator_id,
+                "p_is_mds": is_mds
+            }))
+            return response.data
+
+        cells = await self._get_cells([operator_id], year, [TOTAL_MONTH], is_mds)
+        return cells.get((operator_id, TOTAL_MONTH)) or []
+
+    async def get_team_months(self, operator_ids: list[int], year: int, months: Optional[list[int]],
+                              is_mds: Optional[bool]) -> dict[int, list[dict]]:
+        months = sorted(set(months or ALL_MONTHS))
+        cells = await self._get_cells(operator_ids, year, months, is_mds)
+
+        return {
+            operator_id: [cells[(operator_id, month)] for month in months if cells.get((operator_id, month)) is not None]
+            for operator_id in operator_ids
+        }
+
+    async def invalidate(self, operator_id: int, day: date | datetime | str):
+        await self.invalidate_cells([(operator_id, day)])
+
+    async def invalidate_cells(self, cells: Iterable[tuple[int, date | datetime | str]]):
+        # un update per (consulente, anno) su tutti gli scope, compreso il totale annuo
+        months_by_key: dict[tuple[int, int], set[int]] = {}
+        for operator_id, day in cells:
+            if operator_id is None or day is None:
+                continue
+            day = as_date(day)
+            months_by_key.setdefault((operator_id, day.year), {TOTAL_MONTH}).add(day.month)
+
+        semaphore = asyncio.Semaphore(max(build_concurrency, 1))
+
+        async def mark_stale(operator_id: int, year: int, months: set[int]):
+            async with semaphore:
+                await execute(supabase.table(SUMMARY_TABLE)\
+                    .update({'Stale': True, 'Token': uuid4().hex}, returning=ReturnMethod.minimal)\
+                    .eq('TrainingOperatorId', operator_id)\
+                    .eq('Year', year)\
+                    .in_('Month', sorted(months)))
+
+        await asyncio.gather(*[mark_stale(operator_id, year, months)
+                               for (operator_id, year), months in months_by_key.items()])
+
+    async def _get_cells(self, operator_ids: list[int], year: int, months: list[int],
+                         is_mds: Optional[bool]) -> dict[tuple[int, int], Optional[dict | list]]:
+        if not operator_ids:
+            return {}
+
+        response = await execute(supabase.table(SUMMARY_TABLE)\
+            .select('TrainingOperatorId, Month, Data, Stale, Token')\
+            .eq('Year', year)\
+            .eq('Scope', summary_scope(is_mds))\
+            .in_('TrainingOperatorId', operator_ids)\
+            .in_('Month', months))
+
+        # celle valide e celle da ricalcolare, con il Token atteso (None se la riga manca)
+        cells: dict[tuple[int, int], Optional[dict | list]] = {}
+        pending: dict[tuple[int, int], Optional[str]] = {}
+        for row in response.data:
+            key = (row['TrainingOperatorId'], row['Month'])
+            if row['Stale']:
+                pending[key] = row['Token']
+            else:
+                cells[key] = row['Data']
+
+        for operator_id in operator_ids:
+            for month in months:
+                if (operator_id, month) not in cells and (operator_id, month) not in pending:
+                    pending[(operator_id, month)] = None
+
+        if pending:
+            cells.update(await self._build(year, is_mds, pending))
+        return cells
+
+    async def _build(self, year: int, is_mds: Optional[bool],
+                     pending: dict[tuple[int, int], Optional[str]]) -> dict[tuple[int, int], Optional[dict | list]]:
+        scope = summary_scope(is_mds)
+        token = uuid4().hex
+        expected = {key: current or token for key, current in pending.items()}
+
+        # segnaposto per le celle mancanti prima del calcolo: un'invalidazione che arriva
+        # nel frattempo trova la riga e ne cambia il Token
+        placeholders = [
+            {'TrainingOperatorId': operator_id, 'Year': year, 'Month': month, 'Scope': scope,
+             'Data': None, 'Stale': True, 'Token': token}
+            for (operator_id, month), current in pending.items() if current is None
+        ]
+        if placeholders:
+            await execute(supabase.table(SUMMARY_TABLE)\
+                .upsert(placeholders, on_conflict=SUMMARY_CONFLICT, ignore_duplicates=True, returning=ReturnMethod.minimal))
+
+        cells = await self._fetch(year, is_mds, list(pending))
+
+        # il Token non viene scritto: resta quello del segnaposto o dell'ultima invalidazione
+        await bulk_upsert(SUMMARY_TABLE, [
+            {
+                'TrainingOperatorId': operator_id,
+                'Year': year,
+                'Month': month,
+                'Scope': scope,
+                'Data': data,
+                'Stale': False,
+                'UpdatedAt': datetime.now().isoformat()
+            }
+            for (operator_id, month), data in cells.items()
+        ], on_conflict=SUMMARY_CONFLICT)
+
+        # le celle invalidate durante il calcolo tornano Stale: il dato salvato è già vecchio
+        response = await execute(supabase.table(SUMMARY_TABLE)\
+            .select('TrainingOperatorId, Month, Token')\
+            .eq('Year', year)\
+            .eq('Scope', scope)\
+            .in_('TrainingOperatorId', sorted({operator_id for operator_id, _ in pending}))\
+            .in_('Month', sorted({month for _, month in pending})))
+
+        changed: dict[int, list[int]] = {}
+        for row in response.data:
+            key = (row['TrainingOperatorId'], row['Month'])
+            if key in expected and row['Token'] != expected[key]:
+                changed.setdefault(row['TrainingOperatorId'], []).append(row['Month'])
+
+        for operator_id, months in changed.items():
+            await execute(supabase.table(SUMMARY_TABLE)\
+                .update({'Stale': True}, returning=ReturnMethod.minimal)\
+                .eq('TrainingOperatorId', operator_id)\
+                .eq('Year', year)\
+                .eq('Scope', scope)\
+                .in_('Month', months))
+
+        return cells
+
+    async def _fetch(self, year: int, is_mds: Optional[bool],
+                     keys: list[tuple[int, int]]) -> dict[tuple[int, int], Optional[dict | list]]:
+        # una rpc per consulente per i mesi e una per il totale annuo, al massimo build_concurrency insieme
+        months_by_operator: dict[int, list[int]] = {}
+        totals: list[int] = []
+        for operator_id, month in keys:
+            if month == TOTAL_MONTH:
+                totals.append(operator_id)
+            else:
+                months_by_operator.setdefault(operator_id, []).append(month)
+
+        cells: dict[tuple[int, int], Optional[dict | list]] = {key: None for key in keys}
+        semaphore = asyncio.Semaphore(max(build_concurrency, 1))
+
+        if len(months_by_operator) > 1:
+            # più consulenti: una sola rpc per tutti, tengo solo le celle richieste
+            try:
+                response = await execute(supabase.rpc('get_team_dashboard_summary', {
+                    "p_months": sorted({month for months in months_by_operator.values() for month in months}),
+                    "p_year": year,
+                    "p_training_operator_ids": list(months_by_operator),
+                    "p_is_mds": is_mds
+                }))
+                for row in response.data or []:
+                    key = (row.get('TrainingOperatorId'), row.get('Month'))
+                    if key in cells:
+                        cells[key] = row
+                months_by_operator = {}
+            except APIError as e:
+                # solo se la funzione non esiste: timeout e altri errori del db non vanno
+                # moltiplicati con una rpc per consulente
+                if e.code not in MISSING_FUNCTION_CODES:
+                    raise
+                print(f"get_team_dashboard_summary non disponibile, ricalcolo per consulente: {e}")
+
+        async def fetch_months(operator_id: int, months: list[int]):
+            async with semaphore:
+                response = await execute(supabase.rpc('get_dashboard_summary', {
+                    "p_months": sorted(months),
+                    "p_year": year,
+                    "p_training_operator_id": operator_id,
+                    "p_is_mds": is_mds
+                }))
+            for row in response.data:
+                cells[(operator_id, row.get('Month'))] = row
+
+        async def fetch_total(operator_id: int):
+            async with semaphore:
+                response = await execute(supabase.rpc('get_total_card_summary', {
+                    "p_months": ALL_MONTHS,
+                    "p_year": year,
+                    "p_training_operator_id": operator_id,
+                    "p_is_mds": is_mds
+                }))
+            cells[(operator_id, TOTAL_MONTH)] = response.data or None
+
+        await asyncio.gather(
+            *[fetch_months(operator_id, months) for operator_id, months in months_by_operator.items()],
+            *[fetch_total(operator_id) for operator_id in totals]
+        )
+        return cells
+
+def summary_scope(is_mds: Optional[bool]) -> str:
+    if is_mds is None:
+        return 'all'
+    return 'mds' if is_mds else 'std'
+
+def as_date(day: date | datetime | str) -> date:
+    if isinstance(day, str):
+        return datetime.fromisoformat(day)
+    return day
+
+# Singleton instance
+card_summary_store = CardSummaryStore()
@@ -1,11 +1,106 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
 from dotenv import load_dotenv
+from postgrest import CountMethod, ReturnMethod
 from supabase import create_client, Client
+from metrics import db_query_duration
 
 load_dotenv()
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
+db_max_workers: int = int(os.getenv("DB_MAX_WORKERS", "16"))
 
 # Inizializza il client
-supabase: Client = create_client(url, key)
\ No newline at end of file
+supabase: Client = create_client(url, key)
+
+# Il client supabase è sincrono: ogni .execute() viene spostato su un pool di thread
+# limitato, così l'event loop resta libero di servire le altre richieste
+db_executor = ThreadPoolExecutor(max_workers=db_max_workers, thread_name_prefix="supabase")
+
+class QueryStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+# chiamate al db fatte dalla richiesta HTTP corrente, impostato dal middleware in main.py
+request_db_stats: ContextVar[Optional[QueryStats]] = ContextVar('request_db_stats', default=None)
+
+async def execute(query):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(db_executor, query.execute)
+    finally:
+        elapsed = time.perf_counter() - start
+        db_query_duration.observe(elapsed, target=_query_target(query))
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats.calls += 1
+            stats.seconds += elapsed
+
+def _query_target(query) -> str:
+    # tabella o rpc chiamata, es. "Customer" o "rpc/get_dashboard_summary"
+    path = str(getattr(getattr(query, 'request', None), 'path', ''))
+    return path.rsplit('/rest/v1/', 1)[-1] or 'unknown'
+
+# Righe per pagina nelle letture di tabelle intere: non deve superare il max-rows
+# di PostgREST (1000 di default), altrimenti la prima pagina sembra l'ultima
+select_page_size: int = int(os.getenv("SELECT_PAGE_SIZE", "1000"))
+
+async def select_all(query: Callable[[], Any]) -> list[dict]:
+    # PostgREST tronca le risposte a max-rows: leggo a pagine finché una torna incompleta.
+    # query crea ogni volta una select nuova, ordinata su una colonna univoca
+    rows: list[dict] = []
+    while True:
+        page = await execute(query().range(len(rows), len(rows) + select_page_size - 1))
+        rows.extend(page.data)
+        if len(page.data) < select_page_size:
+            return rows
+
+upsert_chunk_size: int = int(os.getenv("UPSERT_CHUNK_SIZE", "500"))
+upsert_concurrency: int = int(os.getenv("UPSERT_CONCURRENCY", "4"))
+# tentativi aggiuntivi dopo il primo per ogni blocco fallito
+upsert_retries: int = int(os.getenv("UPSERT_RETRIES", "3"))
+
+class BulkUpsertError(Exception):
+    def __init__(self, table: str, written: int, failed: int, error: Exception):
+        super().__init__(f"{table}: {failed} record non scritti ({written} scritti): {error}")
+        self.written = written
+        self.failed = failed
+
+# Upsert a blocchi di UPSERT_CHUNK_SIZE righe, inviati in parallelo:
+# se un blocco fallisce viene ritentato solo quello
+async def bulk_upsert(table: str, rows: list[dict], on_conflict: str) -> int:
+    chunks = [rows[i:i + upsert_chunk_size] for i in range(0, len(rows), upsert_chunk_size)]
+    semaphore = asyncio.Semaphore(max(upsert_concurrency, 1))
+
+    async def write_chunk(chunk: list[dict]) -> int:
+        attempts = max(upsert_retries, 0) + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                async with semaphore:
+                    result = await execute(supabase.table(table).upsert(
+                        chunk,
+                        on_conflict=on_conflict,
+                        count=CountMethod.exact,
+                        returning=ReturnMethod.minimal
+                    ))
+                return result.count if result.count is not None else len(chunk)
+            except Exception as e:
+                if attempt >= attempts:
+                    raise
+                print(f"Upsert {table} fallito (tentativo {attempt}/{attempts}): {e}")
+                # l'attesa è fuori dal semaforo: gli altri blocchi intanto vengono inviati
+                await asyncio.sleep(attempt)
+
+    results = await asyncio.gather(*[write_chunk(chunk) for chunk in chunks], return_exceptions=True)
+    written = sum(r for r in results if not isinstance(r, BaseException))
+    errors = [(chunk, r) for chunk, r in zip(chunks, results) if isinstance(r, BaseException)]
+    if errors:
+        raise BulkUpsertError(table, written, sum(len(chunk) for chunk, _ in errors), errors[0][1])
+    return written
@@ -0,0 +1,77 @@
+import json
+from typing import AsyncIterator
+import httpx
+
+DATASET_KEY = '"dataSet"'
+SEPARATORS = ' \t\r\n,'
+WHITESPACE = ' \t\r\n'
+
+# Legge l'array data.dataSet di una risposta Wellness man mano che arriva,
+# senza caricare in memoria tutto il body: restituisce le righe a blocchi
+async def iter_dataset_batches(response: httpx.Response, batch_size: int) -> AsyncIterator[list[dict]]:
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    in_array = False
+    batch: list[dict] = []
+
+    async for chunk in response.aiter_text():
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+        if not in_array:
+            start = buffer.find(DATASET_KEY)
+            if start < 0:
+                # tengo la coda: la chiave potrebbe essere spezzata tra due chunk
+                pos = max(len(buffer) - len(DATASET_KEY), 0)
+                continue
+            value = dataset_value_start(buffer, start + len(DATASET_KEY))
+            if value is None:
+                # il valore non è ancora arrivato, riparto dalla chiave col prossimo chunk
+                pos = start
+                continue
+            if buffer.startswith('null', value):
+                return
+            if buffer[value] != '[':
+                raise ValueError(f"data.dataSet is not an array: {buffer[value:value + 20]!r}")
+            pos = value + 1
+            in_array = True
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in SEPARATORS:
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                if batch:
+                    yield batch
+                return
+            try:
+                row, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # riga non ancora completa, aspetto il prossimo chunk
+                break
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    raise ValueError("Wellness response ended before the end of data.dataSet")
+
+# Posizione del valore dopo "dataSet": salta spazi e ':'; None se il buffer non lo contiene ancora
+def dataset_value_start(buffer: str, pos: int) -> int | None:
+    while pos < len(buffer) and buffer[pos] in WHITESPACE:
+        pos += 1
+    if pos >= len(buffer):
+        return None
+    if buffer[pos] != ':':
+        raise ValueError("Malformed Wellness response: expected ':' after \"dataSet\"")
+    pos += 1
+    while pos < len(buffer) and buffer[pos] in WHITESPACE:
+        pos += 1
+    if pos >= len(buffer):
+        return None
+    # "null" deve essere completo prima di poterlo riconoscere
+    if buffer[pos] == 'n' and len(buffer) - pos < len('null'):
+        return None
+    return pos
@@ -0,0 +1,43 @@
+import os
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+max_connections: int = int(os.getenv("WELLNESS_MAX_CONNECTIONS", "20"))
+max_keepalive_connections: int = int(os.getenv("WELLNESS_MAX_KEEPALIVE", "10"))
+keepalive_expiry: float = float(os.getenv("WELLNESS_KEEPALIVE_EXPIRY", "30"))
+http2: bool = os.getenv("WELLNESS_HTTP2", "false").lower() == "true"
+
+# Timeout personalizzato
+timeout = httpx.Timeout(
+    connect=10.0,  # Tempo per connettersi
+    read=60.0,  # Tempo per leggere la risposta
+    write=10.0,  # Tempo per scrivere
+    pool=10.0  # Tempo per ottenere connessione dal pool
+)
+
+# Client unico verso Wellness: le connessioni restano aperte (keep-alive)
+# e vengono riusate da login e job invece di rifare ogni volta TCP+TLS
+_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=timeout,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
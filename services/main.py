@@ -1,5 +1,12 @@
-from fastapi import FastAPI
-from routers import auth, jobhelper, customer, card, personal_training, hc
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from database import db_executor, request_db_stats, QueryStats
+from metrics import http_request_duration, http_request_db_calls, http_request_db_duration
+from http_client import get_http_client, close_http_client
+from reference_data import reference_data
+from routers.job_runner import job_runner
+from routers import auth, jobhelper, customer, card, personal_training, hc, metrics
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from dotenv import load_dotenv
@@ -7,9 +14,24 @@ from dotenv import load_dotenv
 load_dotenv()
 
 ORIGIN = os.getenv("ALLOW_ORIGIN")
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # job e cache delle risposte sono in memoria: un solo worker per processo di servizio
+    job_runner.ensure_single_worker()
+    get_http_client()
+    # tipi di sessione e catalogo abbonamenti in memoria, ricaricati periodicamente
+    reference_data.start()
+    yield
+    await job_runner.shutdown()
+    await reference_data.stop()
+    await close_http_client()
+    # attendo le query ancora in corso prima di chiudere il pool
+    db_executor.shutdown(wait=True)
 
 #UVI per dipendenze al posto di PIP
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -26,9 +48,32 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Latenza per route e chiamate a supabase fatte da ogni richiesta
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    stats = QueryStats()
+    token = request_db_stats.set(stats)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        request_db_stats.reset(token)
+        # uso il template della route (/pt/package/active/{customer_id}) per non esplodere le label
+        route = getattr(request.scope.get('route'), 'path', 'unmatched')
+        http_request_duration.observe(elapsed, method=request.method, route=route, status=status_code)
+        http_request_db_calls.observe(stats.calls, route=route)
+        http_request_db_duration.observe(stats.seconds, route=route)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            print(f"Slow request: {request.method} {route} {elapsed:.3f}s, db calls {stats.calls} ({stats.seconds:.3f}s), params {dict(request.query_params)}")
+
 app.include_router(auth.router)
 app.include_router(jobhelper.router)
 app.include_router(customer.router)
 app.include_router(card.router)
 app.include_router(personal_training.router)
 app.include_router(hc.router)
+app.include_router(metrics.router)
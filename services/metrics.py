@@ -0,0 +1,106 @@
+import threading
+from typing import Iterable
+
+# Registro minimale di metriche esposte in formato testo Prometheus su /metrics
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values: dict[tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per ogni combinazione di label: conteggi per bucket, somma, totale
+        self.values: dict[tuple[str, ...], list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, key, 'le="%s"' % bound)
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                labels = _format_labels(self.labels, key, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, description: str, labels: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, description, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+registry = Registry()
+
+# Job di sincronizzazione
+job_runs = registry.counter('sync_job_runs_total', 'Sync job runs by final status', ('job', 'status'))
+job_duration = registry.histogram('sync_job_duration_seconds', 'Sync job total duration', ('job',))
+job_phase_duration = registry.histogram('sync_job_phase_duration_seconds', 'Time spent in each sync job phase', ('job', 'phase'))
+job_rows = registry.counter('sync_job_rows_total', 'Rows handled by each sync job phase', ('job', 'phase'))
+job_bytes = registry.counter('sync_job_bytes_total', 'Bytes downloaded from the Wellness API', ('job',))
+job_errors = registry.counter('sync_job_errors_total', 'Errors raised inside a sync job phase', ('job', 'phase'))
+
+# Richieste HTTP e chiamate a Supabase
+http_request_duration = registry.histogram('http_request_duration_seconds', 'Request latency by route', ('method', 'route', 'status'))
+http_request_db_calls = registry.histogram('http_request_db_calls', 'Supabase calls made by each request', ('route',), buckets=(0, 1, 2, 3, 5, 10, 20, 50))
+http_request_db_duration = registry.histogram('http_request_db_duration_seconds', 'Time spent in Supabase calls by each request', ('route',))
+db_query_duration = registry.histogram('db_query_duration_seconds', 'Supabase call latency by table or rpc', ('target',))
+
+# Cache delle risposte
+cache_requests = registry.counter('response_cache_requests_total', 'Response cache lookups by scope and result', ('scope', 'result'))
@@ -78,6 +78,15 @@ class DataSetItem(BaseModel):
     trainingReferenceOperatorId: int | None
     customerLastAccess: Optional[str]
 
+# Solo i campi letti dal job clienti: gli altri vengono ignorati senza validarli
+class CustomerSyncItem(BaseModel):
+    customerId: int | None = None
+    customerName: str | None = None
+    dateOfBirth: str | None = None
+    customerLastAccess: str | None = None
+    medicalCertificateValidity: str | None = None
+    trainingReferenceOperatorId: int | None = None
+
 class Column(BaseModel):
     field: str
     title: str
@@ -17,4 +17,22 @@ class CustomerOrderBy(str, Enum):
 class Role(str, Enum):
     Secretary = 'SGR'
     Consultant = 'IST'
-    Admin = 'ADM'
\ No newline at end of file
+    Admin = 'ADM'
+
+class JobStatus(str, Enum):
+    Queued = 'queued'
+    Running = 'running'
+    Completed = 'completed'
+    Failed = 'failed'
+    Cancelled = 'cancelled'
+
+class CountMode(str, Enum):
+    Exact = 'exact'
+    Planned = 'planned'
+    Estimated = 'estimated'
+
+class CustomerOverviewGroup(str, Enum):
+    Detail = 'detail'
+    PTActive = 'pt_active'
+    PTHistory = 'pt_history'
+    Cards = 'cards'
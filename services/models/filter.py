@@ -1,6 +1,6 @@
-from typing import Optional
-from pydantic import BaseModel
-from models.enumtype import CustomerWarning, CustomerOrderBy
+from typing import Annotated, Optional
+from pydantic import BaseModel, Field
+from models.enumtype import CustomerWarning, CustomerOrderBy, CountMode
 from models.pagination import PaginationParams
 
 class CustomerDashboardISTFilter(BaseModel):
@@ -12,9 +12,11 @@ class CustomerDashboardISTFilter(BaseModel):
 class CustomerDashboardISTFilterPaginated(PaginationParams, CustomerDashboardISTFilter):
     WarningType: Optional[CustomerWarning] = None
     OrderBy: Optional[CustomerOrderBy] = None
+    Count: Optional[CountMode] = None
 
 class MonthCounterFilter(BaseModel):
-    months: Optional[list[int]] = None
+    # Month 0 è la cella del totale annuo in CardMonthSummary: accetto solo 1..12
+    months: Optional[list[Annotated[int, Field(ge=1, le=12)]]] = None
     year: int
     isMDSSubscription: Optional[bool] = None
     includeNew: Optional[bool] = None
@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel
+from models.enumtype import JobStatus
 
 class User(BaseModel):
     username: str
@@ -32,6 +33,12 @@ class Customer(BaseModel):
     LastAccessDate: datetime | None
     TrainingOperatorId: int | None
     Enabled: bool
+    SyncHash: str | None = None
+
+class CustomerSyncState(BaseModel):
+    IdWinC: int
+    TrainingOperatorId: int | None
+    SyncHash: str | None = None
 
 class Card(BaseModel):
     Id: int
@@ -68,6 +75,13 @@ class PackageHistoryModel(BaseModel):
     CustomerPTId: int
     PackageHistory: list[dict]
 
+class CustomerOverviewModel(BaseModel):
+    CustomerId: int
+    Detail: Optional[list[dict]] = None
+    PTActive: Optional[CustomerPTActiveModel] = None
+    PTHistory: Optional[PackageHistoryModel] = None
+    Cards: Optional[list[dict]] = None
+
 class SessionPTHistoryModel(BaseModel):
     CustomerPTId: int
     DateStart: datetime
@@ -83,4 +97,21 @@ class CardSummary(BaseModel):
     FirstCardRenewed: int
     UpdatesCard: int
     TotalCards: int
-    Month: int
\ No newline at end of file
+    Month: int
+
+class TeamSummaryModel(BaseModel):
+    Total: dict[str, int]
+    Months: list[dict]
+    Operators: list[dict]
+
+class JobInfo(BaseModel):
+    Id: str
+    Name: str
+    Status: JobStatus
+    Phase: Optional[str] = None
+    RowsProcessed: int = 0
+    CreatedAt: datetime
+    StartedAt: Optional[datetime] = None
+    FinishedAt: Optional[datetime] = None
+    ElapsedSeconds: float = 0
+    Error: Optional[str] = None
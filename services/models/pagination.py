@@ -7,11 +7,15 @@ T = TypeVar('T')
 class PaginatedResponse(BaseModel, Generic[T]):
     items: List[T]
     total: int
+    # cursore opaco per la pagina successiva, None se non ce ne sono altre
+    next_cursor: Optional[str] = None
 
 # Classe base
 class PaginationParams(BaseModel):
     page: int
     page_size: int
+    # se presente si pagina per chiave (keyset) invece che con offset
+    cursor: Optional[str] = None
 
     def get_offset(self) -> int:
         return (self.page - 1) * self.page_size
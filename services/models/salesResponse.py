@@ -77,6 +77,18 @@ class DataSetItem(BaseModel):
     trainingReferenceOperatorId: int | None
     customerLastAccess: str | None
 
+# Solo i campi letti dal job abbonamenti cliente: gli altri vengono ignorati senza validarli
+class SalesSyncItem(BaseModel):
+    saleId: int | None = None
+    saleDate: str | None = None
+    start: str | None = None
+    end: str | None = None
+    renewed: bool | None = None
+    customerId: int | None = None
+    salePackageName: str | None = None
+    renewalSalePackageName: str | None = None
+    mainReferenceOperatorId: int | None = None
+
 class Column(BaseModel):
     field: str
     title: str
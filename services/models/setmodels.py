@@ -9,6 +9,7 @@ class CustomerRequest(BaseModel):
     LastAccessDate: str | None
     TrainingOperatorId: int | None
     Enabled: bool
+    SyncHash: str | None = None
 
 class CardRequest(BaseModel):
     CustomerId: int
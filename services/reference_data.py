@@ -0,0 +1,91 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+from models.models import Subscription
+from database import supabase, execute
+
+load_dotenv()
+
+# Tabelle che cambiano raramente (tipi di sessione PT, catalogo abbonamenti):
+# caricate all'avvio e servite dalla memoria, ricaricate ogni REFERENCE_REFRESH_SECONDS
+# o quando il job degli abbonamenti le aggiorna
+
+class ReferenceData:
+    def __init__(self):
+        self.session_types: Optional[list[dict]] = None
+        self.subscriptions: Optional[list[Subscription]] = None
+        # catalogo abbonamenti indicizzato per nome pacchetto normalizzato
+        self.subscription_index: dict[str, Subscription] = {}
+        self.loaded_at: Optional[datetime] = None
+        self.refresh_interval = int(os.getenv("REFERENCE_REFRESH_SECONDS", "3600"))
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    async def get_session_types(self) -> list[dict]:
+        if self.session_types is None:
+            async with self.lock:
+                if self.session_types is None:
+                    await self._load_session_types()
+        return self.session_types
+
+    async def get_subscription_index(self) -> dict[str, Subscription]:
+        if self.subscriptions is None:
+            async with self.lock:
+                if self.subscriptions is None:
+                    await self._load_subscriptions()
+        return self.subscription_index
+
+    async def reload(self):
+        async with self.lock:
+            await asyncio.gather(self._load_session_types(), self._load_subscriptions())
+            self.loaded_at = datetime.now()
+
+    async def reload_subscriptions(self):
+        async with self.lock:
+            await self._load_subscriptions()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.reload()
+            except Exception as e:
+                # restano in uso i dati già caricati, al prossimo giro si riprova
+                print(f"Reference data refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def _load_session_types(self):
+        response = await execute(supabase.table('SessionPTType')\
+            .select('*')\
+            .eq('Enabled', True)\
+            .order('SessionNumber', desc=False))
+        self.session_types = response.data
+
+    async def _load_subscriptions(self):
+        response = await execute(supabase.table("Subscription") \
+            .select("*") \
+            .eq('ValidAsSubscription', True))
+        subscriptions = [Subscription(**item) for item in response.data]
+
+        index: dict[str, Subscription] = {}
+        for subscription in subscriptions:
+            index.setdefault(normalize_package_name(subscription.Description), subscription)
+        # sostituisco entrambi insieme: chi legge non vede mai un catalogo a metà
+        self.subscriptions, self.subscription_index = subscriptions, index
+
+def normalize_package_name(name: str | None) -> str | None:
+    return ' '.join(name.split()).casefold() if name else None
+
+# Singleton instance
+reference_data = ReferenceData()
@@ -0,0 +1,107 @@
+import json
+import os
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from metrics import cache_requests
+
+load_dotenv()
+
+# Cache in memoria delle risposte degli endpoint di lettura.
+# Ogni voce ha dei tag (es. "customer:123", "summary:7", "dashboard"):
+# le scritture invalidano solo le voci con i tag coinvolti, non tutta la cache
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: int):
+        self.entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # tag -> chiavi che lo usano; le chiavi scadute vengono ripulite all'invalidazione
+        self.tags: dict[str, set[Hashable]] = {}
+        self.maxsize = maxsize
+        # incrementato a ogni invalidazione: un caricamento iniziato prima non viene salvato
+        self.generation = 0
+
+    @staticmethod
+    def key(scope: str, user: dict, params: Any = None) -> tuple:
+        if isinstance(params, BaseModel):
+            params = params.model_dump(mode='json', exclude_none=True)
+        normalized = json.dumps(params, sort_keys=True, default=str)
+        return scope, user.get('id'), str(user.get('role')), normalized
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        return self.entries.get(key)
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str]):
+        self.entries[key] = value
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        if len(self.tags) > self.maxsize * 4:
+            self._prune()
+
+    async def get_or_load(self, key: tuple, tags: Iterable[str] | Callable[[Any], Iterable[str]],
+                          loader: Callable[[], Awaitable[Any]]) -> Any:
+        cached = self.entries.get(key)
+        scope = key[0]
+        if cached is not None:
+            cache_requests.inc(scope=scope, result='hit')
+            return cached
+
+        cache_requests.inc(scope=scope, result='miss')
+        generation = self.generation
+        value = await loader()
+        if value is not None and generation == self.generation:
+            # i tag possono dipendere dalla risposta (es. gli IdWinC presenti nella pagina)
+            self.set(key, value, tags(value) if callable(tags) else tags)
+        return value
+
+    async def get_many_or_load(self, keys: dict[Any, tuple], tags: Callable[[Any], Iterable[str]],
+                               loader: Callable[[list], Awaitable[dict]]) -> dict:
+        # come get_or_load per più voci: quelle mancanti vengono caricate con una sola chiamata
+        values: dict = {}
+        missing: list = []
+        for item, key in keys.items():
+            cached = self.entries.get(key)
+            if cached is not None:
+                values[item] = cached
+            else:
+                missing.append(item)
+            cache_requests.inc(scope=key[0], result='hit' if cached is not None else 'miss')
+
+        if missing:
+            generation = self.generation
+            loaded = await loader(missing)
+            if generation == self.generation:
+                for item, value in loaded.items():
+                    self.set(keys[item], value, tags(item))
+            values.update(loaded)
+        return values
+
+    def invalidate(self, *tags: str):
+        self.generation += 1
+        for tag in tags:
+            for key in self.tags.pop(tag, ()):
+                self.entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.tags.clear()
+
+    def _prune(self):
+        for tag in list(self.tags):
+            alive = {key for key in self.tags[tag] if key in self.entries}
+            if alive:
+                self.tags[tag] = alive
+            else:
+                del self.tags[tag]
+
+# La cache vive nel processo: un'invalidazione vale solo per il worker che ha gestito
+# la scrittura. Il servizio gira con un solo worker (controllato all'avvio in main.py,
+# vedi JobRunner.ensure_single_worker); la durata resta comunque breve.
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+
+# Singleton instance
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+    ttl=RESPONSE_CACHE_TTL
+)
@@ -1,7 +1,8 @@
 from datetime import timedelta, timezone, datetime
 from typing import Annotated
+from cachetools import TTLCache
 from fastapi import HTTPException, status, Depends, APIRouter
-from database import supabase
+from database import supabase, execute
 from models.models import Token, Consultant
 import os
 from dotenv import load_dotenv
@@ -14,6 +15,11 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/token")
+# consulenti già letti dal db, per email: evita la query su User a ogni login
+consultant_cache: TTLCache = TTLCache(
+    maxsize=int(os.getenv("CONSULTANT_CACHE_SIZE", "256")),
+    ttl=int(os.getenv("CONSULTANT_CACHE_TTL", "600"))
+)
 
 router = APIRouter(
     prefix="/auth",
@@ -21,19 +27,26 @@ router = APIRouter(
 )
 
 async def get_user_by_username(username: str):
+    cached = consultant_cache.get(username)
+    if cached is not None:
+        return cached
+
     # Query con filtri multipli
-    users_db = supabase.table("User") \
+    users_db = await execute(supabase.table("User") \
         .select("*") \
         .eq("Enabled", True) \
-        .eq("Email", username) \
-        .execute()
+        .eq("Email", username))
     docs = [Consultant(**item) for item in users_db.data]
 
     if not docs:
         raise HTTPException(status_code=404, detail="Utente non trovato o non abilitato")
     # Assumendo che l'email sia unica, prendo il primo risultato
+    consultant_cache[username] = docs[0]
     return docs[0]
 
+def invalidate_consultant_cache():
+    consultant_cache.clear()
+
 @router.post('/token', response_model=Token, status_code=status.HTTP_200_OK)
 async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     # verificare se è presente nel mio db
@@ -1,45 +1,109 @@
+import asyncio
+import hashlib
 from datetime import datetime, timedelta
-from typing import Optional
-import httpx
 import os
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import HTTPException, status
+from pydantic import BaseModel
+from http_client import get_http_client
 
 load_dotenv()
 
+class CachedToken(BaseModel):
+    token: str
+    expiry: datetime
+
 class ExternalAPIAuth:
     def __init__(self):
-        self.token: Optional[str] = None
-        self.token_expiry: Optional[datetime] = None
         self.api_url = os.getenv("WELLNESS_URL")
+        self.token_duration = timedelta(hours=1)
+        # un token per ogni credenziale, non uno solo condiviso da tutti: token e lock
+        # sono in cache limitate, così tentativi con credenziali sempre diverse non accumulano memoria
+        cache_size = int(os.getenv("WELLNESS_TOKEN_CACHE_SIZE", "256"))
+        ttl = self.token_duration.total_seconds()
+        self.tokens: TTLCache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.locks: TTLCache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.refresh_tasks: dict[str, asyncio.Task] = {}
+        # rinnovo in background quando mancano meno di N secondi alla scadenza
+        self.refresh_margin = timedelta(seconds=int(os.getenv("WELLNESS_TOKEN_REFRESH_MARGIN", "300")))
 
     async def get_token(self, username: str, password: str) -> str:
+        key = self._credential_key(username, password)
+        cached = self.tokens.get(key)
+
         # Se il token è valido, riutilizzalo
-        if self.token and self.token_expiry and datetime.now() < self.token_expiry:
-            return self.token
-
-        print("login to do")
-        # Altrimenti fai il login
-        return await self._login(username, password)
-
-    async def _login(self, username: str, password: str) -> str:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.api_url}/login",
-                json={"username": username, "password": password}
-            )
-            if response.status_code == status.HTTP_200_OK:
-                data = response.json()
+        if cached and datetime.now() < cached.expiry:
+            if datetime.now() >= cached.expiry - self.refresh_margin:
+                self._schedule_refresh(key, username, password)
+            return cached.token
+
+        # Altrimenti fai il login: un solo login per credenziale, gli altri attendono il risultato
+        async with self._lock(key):
+            cached = self.tokens.get(key)
+            if cached and datetime.now() < cached.expiry:
+                return cached.token
+
+            print("login to do")
+            try:
+                return await self._login(key, username, password)
+            except Exception:
+                # login fallito: non tengo il lock di una credenziale che non ha token
+                self.locks.pop(key, None)
+                raise
+
+    def _schedule_refresh(self, key: str, username: str, password: str):
+        task = self.refresh_tasks.get(key)
+        if task is not None and not task.done():
+            return
+        self.refresh_tasks[key] = asyncio.create_task(self._refresh(key, username, password))
 
-                self.token = data.get('data').get('token')
-                # Imposta scadenza (es. 1 ora)
-                self.token_expiry = datetime.now() + timedelta(hours=1)
+    async def _refresh(self, key: str, username: str, password: str):
+        try:
+            async with self._lock(key):
+                cached = self.tokens.get(key)
+                if cached and datetime.now() < cached.expiry - self.refresh_margin:
+                    return
+                try:
+                    await self._login(key, username, password)
+                except Exception as e:
+                    # il token attuale è ancora valido: al prossimo giro si riprova
+                    print(f"token refresh failed: {e}")
+        finally:
+            self.refresh_tasks.pop(key, None)
 
-                return self.token
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials'
-                )
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def _credential_key(username: str, password: str) -> str:
+        return hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+
+    async def _login(self, key: str, username: str, password: str) -> str:
+        client = get_http_client()
+        response = await client.post(
+            f"{self.api_url}/login",
+            json={"username": username, "password": password}
+        )
+        if response.status_code == status.HTTP_200_OK:
+            data = response.json()
+
+            token = data.get('data').get('token')
+            # Imposta scadenza (es. 1 ora)
+            self.tokens[key] = CachedToken(token=token, expiry=datetime.now() + self.token_duration)
+
+            return token
+        else:
+            # solo 401/403 vuol dire credenziali non più valide: un errore temporaneo (es. 5xx)
+            # lascia il token attuale, che il rinnovo anticipato può ancora usare fino alla scadenza
+            if response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN):
+                self.tokens.pop(key, None)
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials'
+            )
 
 # Singleton instance
-auth_manager = ExternalAPIAuth()
\ No newline at end of file
+auth_manager = ExternalAPIAuth()
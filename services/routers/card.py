@@ -1,14 +1,18 @@
-from datetime import timedelta
-from typing import Annotated
+from datetime import datetime, timedelta
+from typing import Annotated, Awaitable, Callable
 from fastapi import HTTPException, status, Depends, APIRouter
 from fastapi.params import Query
 from postgrest import CountMethod
+from models.enumtype import Role
 from models.filter import MonthCounterFilter
 from models.setmodels import CardRequest, CardInsert
-from models.models import Card
+from models.models import Card, TeamSummaryModel
 from routers.auth import get_current_user
 from dotenv import load_dotenv
-from database import supabase
+from database import supabase, execute
+from response_cache import response_cache
+from card_summary import card_summary_store
+from routers.customer import invalidate_customer
 
 user_dependency = Annotated[dict, Depends(get_current_user)]
 load_dotenv()
@@ -21,14 +25,39 @@ router = APIRouter(
 @router.get('/summary', status_code=status.HTTP_200_OK)
 async def card_summary(user: user_dependency, params: MonthCounterFilter = Query()):
     try:
-        return await get_query_cards_count(user, 'get_dashboard_summary', params)
+        return await response_cache.get_or_load(
+            response_cache.key('summary', user, params),
+            get_summary_tags(user),
+            lambda: get_query_cards_count(user, card_summary_store.get_months, params)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get('/summary/total', status_code=status.HTTP_200_OK)
 async def card_summary_total(user: user_dependency, params: MonthCounterFilter = Query()):
     try:
-        return await get_query_cards_count(user, 'get_total_card_summary', params)
+        return await response_cache.get_or_load(
+            response_cache.key('summary_total', user, params),
+            get_summary_tags(user),
+            lambda: get_query_cards_count(user, card_summary_store.get_total, params)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Riepilogo di tutti i consulenti per gli admin: una lettura delle celle mensili
+# e aggregazione per colonne in memoria
+@router.get('/summary/team', status_code=status.HTTP_200_OK, response_model=TeamSummaryModel)
+async def card_summary_team(user: user_dependency, params: MonthCounterFilter = Query()):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication failed")
+    if Role.Admin.value not in user.get('role'):
+        raise HTTPException(status_code=403, detail="Operation not permitted")
+    try:
+        return await response_cache.get_or_load(
+            response_cache.key('summary_team', user, params),
+            lambda summary: ['summary'] + [f"summary:{row['TrainingOperatorId']}" for row in summary.Operators],
+            lambda: get_team_summary(params)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -37,13 +66,12 @@ async def create_card(user: user_dependency,card: CardRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
     try:
-        supabase.table('Card')\
+        disabled = await execute(supabase.table('Card')\
             .update({'Enabled': False})\
             .eq('Enabled', True)\
-            .eq('CustomerId', card.CustomerId)\
-            .execute()
+            .eq('CustomerId', card.CustomerId))
 
-        result = supabase.table('Card')\
+        result = await execute(supabase.table('Card')\
         .insert([
             CardInsert(
                 DateEnd=card.DateStart + timedelta(weeks=card.DurationWeek),
@@ -53,8 +81,11 @@ async def create_card(user: user_dependency,card: CardRequest):
                 DurationWeek=card.DurationWeek,
                 DateStart=card.DateStart
             ).model_dump()
-        ]) \
-        .execute()
+        ]))
+        await invalidate_card(card.CustomerId, user.get('id'), card.DateStart)
+        # come nell'undo: anche le schede disattivate cambiano il riepilogo del loro mese
+        await card_summary_store.invalidate_cells((row.get('TrainingOperatorId'), row.get('DateStart')) for row in disabled.data)
+        response_cache.invalidate(*[f"summary:{row.get('TrainingOperatorId')}" for row in disabled.data])
      #result.data -> forse mi serve per aggiornare la scheda che visualizzo??
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -64,10 +95,12 @@ async def reschedule_card(user: user_dependency, card_id: int):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
     try:
-        supabase.table('Card')\
+        result = await execute(supabase.table('Card')\
             .update({'Rescheduled': True})\
-            .eq('Id', card_id)\
-            .execute()
+            .eq('Id', card_id))
+        if result.data:
+            updated = result.data[0]
+            await invalidate_card(updated.get('CustomerId'), updated.get('TrainingOperatorId'), updated.get('DateStart'))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -76,43 +109,73 @@ async def reschedule_card(user: user_dependency, card_id: int):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
 
-    result = supabase.table('Card')\
+    result = await execute(supabase.table('Card')\
         .select('*')\
-        .eq('Id', card_id)\
-        .execute()
+        .eq('Id', card_id))
 
     card = Card(**result.data[0])
 
     if card.Rescheduled:
-        supabase.table('Card')\
+        await execute(supabase.table('Card')\
             .update({'Rescheduled': False})\
-            .eq('Id', card_id)\
-            .execute()
+            .eq('Id', card_id))
     else:
-        supabase.table('Card')\
+        await execute(supabase.table('Card')\
             .delete()\
-            .eq('Id', card_id)\
-            .execute()
+            .eq('Id', card_id))
 
-        old_card = supabase.table('Card') \
-            .select('Id', count = CountMethod.exact) \
+        old_card = await execute(supabase.table('Card') \
+            .select('Id, TrainingOperatorId, DateStart', count = CountMethod.exact) \
             .eq('CustomerId', card.CustomerId)\
             .eq('CustomerSubscriptionId', card.CustomerSubscriptionId)\
             .eq('Enabled', False)\
             .order('DateStart', desc=True)\
-            .limit(1)\
-            .execute()
+            .limit(1))
 
         if old_card is not None and old_card.count > 0:
-            supabase.table('Card')\
+            await execute(supabase.table('Card')\
                 .update({'Enabled': True})\
-                .eq('Id', old_card.data[0].get('Id'))\
-                .execute()
-
-async def get_query_cards_count(user: user_dependency, table_name: str, params: MonthCounterFilter):
+                .eq('Id', old_card.data[0].get('Id')))
+            await card_summary_store.invalidate(old_card.data[0].get('TrainingOperatorId'), old_card.data[0].get('DateStart'))
+            response_cache.invalidate(f"summary:{old_card.data[0].get('TrainingOperatorId')}")
+
+    await invalidate_card(card.CustomerId, card.TrainingOperatorId, card.DateStart)
+
+def get_summary_tags(user) -> list[str]:
+    return ['summary', f"summary:{user.get('id')}"]
+
+async def invalidate_card(customer_id: int, operator_id: int, date_start: datetime | str):
+    # la scheda cambia la riga del cliente in dashboard e il riepilogo del consulente:
+    # prima la cella del mese, poi la cache delle risposte che la leggono.
+    # La dashboard è filtrata per il consulente assegnato al cliente, che può
+    # essere diverso da chi ha scritto la scheda: invalido entrambi
+    await card_summary_store.invalidate(operator_id, date_start)
+    owner = await execute(supabase.table('Customer')\
+        .select('TrainingOperatorId')\
+        .eq('IdWinC', customer_id))
+    owner_id = owner.data[0].get('TrainingOperatorId') if owner.data else None
+    invalidate_customer(customer_id, operator_id, owner_id)
+    response_cache.invalidate(f'summary:{operator_id}')
+
+async def get_query_cards_count(user: user_dependency, source: Callable[..., Awaitable[list[dict]]], params: MonthCounterFilter):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
 
+    active_columns = get_active_columns(params)
+
+    # celle mensili precalcolate (vedi card_summary.py) invece delle rpc ricalcolate a ogni richiesta
+    rows = await source(user.get('id'), params.year, params.months, params.isMDSSubscription)
+
+    if active_columns:
+        result = []
+        for row in rows:
+            total = sum(row[col] for col in active_columns)
+            result.append({**row, "TotalCards": total})
+        return result
+    else:
+        return rows
+
+def get_active_columns(params: MonthCounterFilter) -> list[str]:
     filter_map = [
         (params.includeNew, "FirstCardNewCustomer"),
         (params.includeRenewed, "FirstCardRenewed"),
@@ -120,23 +183,59 @@ async def get_query_cards_count(user: user_dependency, table_name: str, params:
         (params.includePT, "TotalSession"),
     ]
 
-    active_columns = [col for flag, col in filter_map if flag]
+    return [col for flag, col in filter_map if flag]
 
-    response = supabase.rpc(
-        table_name,
-        {
-            "p_months": params.months,
-            "p_year": params.year,
-            "p_training_operator_id": user.get('id'),
-            "p_is_mds": params.isMDSSubscription
-        }
-    ).execute()
+COUNTER_COLUMNS = ["FirstCardNewCustomer", "FirstCardRenewed", "UpdatesCard", "TotalSession"]
 
+async def get_team_summary(params: MonthCounterFilter) -> TeamSummaryModel:
+    operators: dict[int, str] = {}
+
+    async def find_operators() -> list[int]:
+        # solo i consulenti attivi: segreteria, amministratori e utenti disabilitati non hanno schede
+        response = await execute(supabase.table('User')\
+            .select('IdWinC, Name, Surname')\
+            .eq('Enabled', True)\
+            .contains('Role', [Role.Consultant.value]))
+        for item in response.data:
+            operators[item['IdWinC']] = f"{item.get('Name') or ''} {item.get('Surname') or ''}".strip()
+        return list(operators)
+
+    rows_by_operator = await card_summary_store.get_team_months(
+        await find_operators(), params.year, params.months, params.isMDSSubscription
+    )
+
+    # una riga per (consulente, mese) ridotta a colonne: ogni contatore è una lista allineata
+    rows = [(operator_id, row) for operator_id, operator_rows in rows_by_operator.items() for row in operator_rows]
+    operator_keys = [operator_id for operator_id, _ in rows]
+    month_keys = [row.get('Month') for _, row in rows]
+    columns: dict[str, list[int]] = {col: [row.get(col) or 0 for _, row in rows] for col in COUNTER_COLUMNS}
+
+    # TotalCards secondo la combinazione includeNew/includeRenewed/includeUpdates/includePT
+    active_columns = get_active_columns(params)
     if active_columns:
-        result = []
-        for row in response.data:
-            total = sum(row[col] for col in active_columns)
-            result.append({**row, "TotalCards": total})
-        return result
+        columns["TotalCards"] = [sum(values) for values in zip(*(columns[col] for col in active_columns))]
     else:
-        return response.data
+        columns["TotalCards"] = [row.get("TotalCards") or 0 for _, row in rows]
+
+    by_operator = {col: group_sum(operator_keys, values) for col, values in columns.items()}
+    by_month = {col: group_sum(month_keys, values) for col, values in columns.items()}
+
+    operator_rows = [
+        {'TrainingOperatorId': operator_id, 'Name': operators.get(operator_id), **{col: by_operator[col][operator_id] for col in columns}}
+        for operator_id in dict.fromkeys(operator_keys)
+    ]
+    operator_rows.sort(key=lambda row: row["TotalCards"], reverse=True)
+    for rank, row in enumerate(operator_rows, start=1):
+        row['Rank'] = rank
+
+    return TeamSummaryModel(
+        Total={col: sum(values) for col, values in columns.items()},
+        Months=[{'Month': month, **{col: by_month[col][month] for col in columns}} for month in sorted(by_month["TotalCards"])],
+        Operators=operator_rows
+    )
+
+def group_sum(keys: list, values: list[int]) -> dict:
+    totals: dict = {}
+    for key, value in zip(keys, values):
+        totals[key] = totals.get(key, 0) + value
+    return totals
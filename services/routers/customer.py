@@ -1,13 +1,19 @@
-from collections import Counter
-from typing import Annotated
+import asyncio
+import base64
+import json
+from typing import Annotated, Any, Optional
+import os
 from fastapi import HTTPException, status, Depends, APIRouter, Query
 from postgrest import CountMethod
-from models.enumtype import Role, CustomerOrderBy
+from models.enumtype import Role, CustomerOrderBy, CustomerWarning, CountMode, CustomerOverviewGroup
 from models.filter import CustomerDashboardISTFilter, CustomerDashboardISTFilterPaginated
+from models.models import CustomerOverviewModel
 from models.pagination import PaginatedResponse
 from models.setmodels import CustomerDescriptionRequest
 from routers.auth import get_current_user
-from database import supabase
+from routers.personal_training import cached_active_package, cached_history_packages
+from database import supabase, execute
+from response_cache import response_cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,84 +24,254 @@ router = APIRouter(
     tags=['customer']
 )
 
+# numero massimo di clienti per /detail/batch
+detail_batch_size: int = int(os.getenv("DETAIL_BATCH_SIZE", "100"))
+
+# colonna di ordinamento e verso per ogni CustomerOrderBy; IdWinC fa da spareggio
+DASHBOARD_ORDER: dict[CustomerOrderBy, tuple[str, bool]] = {
+    CustomerOrderBy.Default: ('Warning', True),
+    CustomerOrderBy.NameAsc: ('Name', False),
+    CustomerOrderBy.NameDesc: ('Name', True),
+    CustomerOrderBy.LastAccessDate: ('LastAccessDate', True),
+    CustomerOrderBy.LastCard: ('StartDate', True),
+}
+
 @router.get("/dashboard", status_code=status.HTTP_200_OK, response_model=PaginatedResponse[dict])
 async def list_users(user: user_dependency, filters: CustomerDashboardISTFilterPaginated = Query()):
+    order_by = filters.OrderBy or CustomerOrderBy.Default
+    column, desc = DASHBOARD_ORDER[order_by]
+    cursor = decode_cursor(filters.cursor, order_by) if filters.cursor else None
     try:
-        query = get_dashboard_filtered(filters, user)
-
-        if filters.WarningType is not None:
-            query.eq('Warning', filters.WarningType.value)
-
-        if filters.OrderBy is None or filters.OrderBy == CustomerOrderBy.Default.value:
-            query.order('Warning', desc=True)
-        elif filters.OrderBy == CustomerOrderBy.NameAsc.value:
-            query.order('Name', desc=False, nullsfirst=False)
-        elif filters.OrderBy == CustomerOrderBy.NameDesc.value:
-            query.order('Name', desc=True, nullsfirst=False)
-        elif filters.OrderBy == CustomerOrderBy.LastAccessDate.value:
-            query.order('LastAccessDate', desc=True, nullsfirst=False)
-        elif filters.OrderBy == CustomerOrderBy.LastCard.value:
-            query.order('StartDate', desc=True, nullsfirst=False)
-
-        result = query\
-            .offset(filters.get_offset())\
-            .limit(filters.page_size)\
-            .execute()
-
-        return PaginatedResponse[dict](
-            items=result.data,
-            total=result.count
+        # la pagina è legata anche ai clienti che contiene: una scrittura su uno di loro la invalida
+        return await response_cache.get_or_load(
+            response_cache.key('dashboard', user, filters),
+            lambda page: get_dashboard_tags(filters, user) + [f"customer:{item.get('IdWinC')}" for item in page.items],
+            lambda: load_dashboard_page(filters, user, order_by, column, desc, cursor)
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def load_dashboard_page(filters: CustomerDashboardISTFilterPaginated, user, order_by: CustomerOrderBy,
+                              column: str, desc: bool, cursor: Optional[tuple[Any, int]]) -> PaginatedResponse[dict]:
+    # totale righe per combinazione di filtri: il count completo sulla vista
+    # si rifà solo quando cambiano i filtri o i dati, non a ogni pagina
+    # i totali stimati hanno una chiave propria e non vengono mai restituiti a chi chiede exact;
+    # chi accetta una stima può invece riusare un totale exact già calcolato
+    count_mode = filters.Count or CountMode.Exact
+    count_key = get_dashboard_count_key(filters, user, count_mode)
+    total: Optional[int] = response_cache.get(count_key)
+    if total is None and count_mode != CountMode.Exact:
+        total = response_cache.get(get_dashboard_count_key(filters, user, CountMode.Exact))
+    count_method = None if total is not None else CountMethod(count_mode.value)
+    query = get_dashboard_filtered(filters, user, count_method)
+
+    if filters.WarningType is not None:
+        query.eq('Warning', filters.WarningType.value)
+
+    query.order(column, desc=desc, nullsfirst=False)
+    query.order('IdWinC', desc=False)
+
+    if cursor is not None:
+        # riparto dall'ultima riga vista: costo costante anche sulle pagine profonde
+        apply_cursor(query, column, desc, cursor[0], cursor[1])
+    else:
+        query.offset(filters.get_offset())
+
+    result = await execute(query.limit(filters.page_size))
+
+    if total is None:
+        total = result.count if result.count is not None else len(result.data)
+        response_cache.set(count_key, total, get_dashboard_tags(filters, user))
+
+    next_cursor = None
+    if len(result.data) == filters.page_size:
+        last = result.data[-1]
+        next_cursor = encode_cursor(order_by, last.get(column), last.get('IdWinC'))
+
+    return PaginatedResponse[dict](
+        items=result.data,
+        total=total,
+        next_cursor=next_cursor
+    )
+
 @router.get("/dashboard/count", status_code=status.HTTP_200_OK)
 async def list_users(user: user_dependency, filters: CustomerDashboardISTFilter = Query()):
     try:
-        query = get_dashboard_filtered(filters, user)
-
-        response = query.execute()
-        warning_counts = Counter(item['Warning'] for item in response.data)
-
-        return warning_counts
+        return await response_cache.get_or_load(
+            response_cache.key('dashboard_count', user, filters),
+            get_dashboard_tags(filters, user),
+            lambda: load_warning_counts(filters, user)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def load_warning_counts(filters: CustomerDashboardISTFilter, user) -> dict[str, int]:
+    # raggruppamento fatto dal db: una riga per Warning invece di tutti i clienti
+    query = get_dashboard_filtered(filters, user, count=None, columns='Warning, count()')
+
+    response = await execute(query)
+    warning_counts = {warning.value: 0 for warning in CustomerWarning}
+    for item in response.data:
+        warning_counts[item['Warning']] = item['count']
+
+    return warning_counts
+
 @router.get("/detail", status_code=status.HTTP_200_OK)
 async def detail_user(user: user_dependency, customer: int = Query(gt=1)):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        view: str = "vw_DetailCustomer_Secretary" if Role.Secretary.value in user.get('role') else "vw_DetailCustomer_Consultant"
+        return await cached_detail(user, customer)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def cached_detail(user, customer: int) -> list[dict]:
+    return await response_cache.get_or_load(
+        response_cache.key('detail', user, customer),
+        ['detail', f'customer:{customer}'],
+        lambda: load_detail(user, customer)
+    )
+
+async def load_detail(user, customer: int) -> list[dict]:
+    result = await execute(supabase.table(get_detail_view(user))\
+        .select('*')\
+        .eq('IdWinC', customer))
+
+    return result.data
+
+# Dettaglio di più clienti con una sola query: restituisce IdWinC -> righe del dettaglio
+@router.get("/detail/batch", status_code=status.HTTP_200_OK, response_model=dict[int, list[dict]])
+async def detail_users(user: user_dependency, customers: list[int] = Query(min_length=1, max_length=detail_batch_size)):
+    if user is None:
+        raise HTTPException(status_code=401, detail='Authentication Failed')
+    try:
+        # le voci sono le stesse di /detail: un cliente già aperto non viene riletto
+        keys = {customer: response_cache.key('detail', user, customer) for customer in dict.fromkeys(customers)}
+        return await response_cache.get_many_or_load(
+            keys,
+            lambda customer: ['detail', f'customer:{customer}'],
+            lambda missing: load_details(user, missing)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def load_details(user, customers: list[int]) -> dict[int, list[dict]]:
+    result = await execute(supabase.table(get_detail_view(user))\
+        .select('*')\
+        .in_('IdWinC', customers))
+
+    details: dict[int, list[dict]] = {customer: [] for customer in customers}
+    for row in result.data:
+        details.setdefault(row.get('IdWinC'), []).append(row)
+    return details
 
-        result = supabase.table(view)\
-            .select('*')\
-            .eq('IdWinC', customer)\
-            .execute()
+# Scheda cliente completa in una sola chiamata: i gruppi richiesti vengono letti in parallelo
+@router.get("/overview/{customer_id}", status_code=status.HTTP_200_OK, response_model=CustomerOverviewModel, response_model_exclude_unset=True)
+async def customer_overview(user: user_dependency, customer_id: int, include: list[CustomerOverviewGroup] = Query(default=list(CustomerOverviewGroup))):
+    if user is None:
+        raise HTTPException(status_code=401, detail='Authentication Failed')
+    try:
+        # gruppo -> campo della risposta e lettura (stesse voci di cache degli endpoint singoli)
+        loaders = {
+            CustomerOverviewGroup.Detail: ('Detail', lambda: cached_detail(user, customer_id)),
+            CustomerOverviewGroup.PTActive: ('PTActive', lambda: cached_active_package(user, customer_id)),
+            CustomerOverviewGroup.PTHistory: ('PTHistory', lambda: cached_history_packages(user, customer_id)),
+            CustomerOverviewGroup.Cards: ('Cards', lambda: cached_cards(user, customer_id)),
+        }
+        groups = list(dict.fromkeys(include))
+        results = await asyncio.gather(*[loaders[group][1]() for group in groups])
 
-        return result.data
+        return CustomerOverviewModel(CustomerId=customer_id, **{loaders[group][0]: result for group, result in zip(groups, results)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def cached_cards(user, customer: int) -> list[dict]:
+    return await response_cache.get_or_load(
+        response_cache.key('cards', user, customer),
+        ['cards', f'customer:{customer}'],
+        lambda: load_cards(customer)
+    )
+
+async def load_cards(customer: int) -> list[dict]:
+    result = await execute(supabase.table('Card')\
+        .select('*')\
+        .eq('CustomerId', customer)\
+        .order('DateStart', desc=True))
+
+    return result.data
+
 @router.put("/description", status_code=status.HTTP_204_NO_CONTENT)
 async def description_user(user: user_dependency, params: CustomerDescriptionRequest):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        supabase.table('Customer')\
+        await execute(supabase.table('Customer')\
             .update({ 'DescriptionSGR' if Role.Secretary.value in user.get('role') else 'DescriptionIST': params.Description })\
-            .eq('IdWinC', params.CustomerId)\
-            .execute()
+            .eq('IdWinC', params.CustomerId))
+        invalidate_customer(params.CustomerId)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_dashboard_filtered(filters, user):
+def encode_cursor(order_by: CustomerOrderBy, value: Any, id_win_c: int) -> str:
+    payload = json.dumps([order_by.value, value, id_win_c], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str, order_by: CustomerOrderBy) -> tuple[Any, int]:
+    try:
+        cursor_order, value, id_win_c = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail='Cursore non valido')
+    if cursor_order != order_by.value:
+        raise HTTPException(status_code=400, detail="Cursore non valido per l'ordinamento richiesto")
+    return value, int(id_win_c)
+
+def apply_cursor(query, column: str, desc: bool, value: Any, id_win_c: int):
+    # ordinamento con i null in fondo: dopo un valore vengono i minori (o maggiori), poi i null
+    if value is None:
+        query.is_(column, 'null').gt('IdWinC', id_win_c)
+    else:
+        literal = quote_filter_value(value)
+        query.or_(f"{column}.{'lt' if desc else 'gt'}.{literal},{column}.is.null,"
+                  f"and({column}.eq.{literal},IdWinC.gt.{id_win_c})")
+
+def quote_filter_value(value: Any) -> str:
+    # i valori dentro or=(...) vanno quotati: nomi e date contengono virgole, punti e due punti
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+def get_detail_view(user) -> str:
+    return "vw_DetailCustomer_Secretary" if Role.Secretary.value in user.get('role') else "vw_DetailCustomer_Consultant"
+
+def get_dashboard_view(user) -> str:
+    return "vw_DashboardSecretary" if Role.Secretary.value in user.get('role') else "vw_DashboardConsultant"
+
+def get_dashboard_count_key(filters: CustomerDashboardISTFilterPaginated, user, count_mode: CountMode) -> tuple:
+    # paginazione (anche per cursore) e ordinamento non cambiano il totale, la modalità di conteggio sì
+    values = filters.model_dump(mode='json', exclude={'page', 'page_size', 'cursor', 'OrderBy', 'Count'})
+    return 'dashboard_total', get_dashboard_view(user), user.get('id'), count_mode.value, tuple(sorted(values.items()))
+
+def get_dashboard_tags(filters: CustomerDashboardISTFilter, user) -> list[str]:
+    # le voci della dashboard sono legate al consulente filtrato; la ricerca per nome
+    # senza consulente attraversa tutti i consulenti
+    if filters.TrainerOperatorId is not None:
+        operator = filters.TrainerOperatorId
+    elif filters.CustomerName is None:
+        operator = user.get('id')
+    else:
+        operator = 'search'
+    return ['dashboard', f'dashboard:{operator}']
+
+def invalidate_customer(customer_id: int, *operator_ids: Optional[int]):
+    tags = [f'customer:{customer_id}', 'dashboard:search']
+    tags.extend(f'dashboard:{operator_id}' for operator_id in set(operator_ids) if operator_id is not None)
+    response_cache.invalidate(*tags)
+
+def get_dashboard_filtered(filters, user, count: Optional[CountMethod] = CountMethod.exact, columns: str = '*'):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
 
-    query = supabase.table(
-        "vw_DashboardSecretary" if Role.Secretary.value in user.get('role') else "vw_DashboardConsultant") \
-        .select('*', count= CountMethod.exact)
+    query = supabase.table(get_dashboard_view(user)) \
+        .select(columns, count=count)
 
     if filters.CustomerName is not None:
         query.ilike('Name', f'%{filters.CustomerName}%')
@@ -0,0 +1,190 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import os
+from dotenv import load_dotenv
+from models.enumtype import JobStatus
+from models.models import JobInfo
+from metrics import job_runs, job_duration, job_phase_duration, job_rows, job_bytes, job_errors
+
+load_dotenv()
+
+class JobState:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = JobStatus.Queued
+        self.phase: Optional[str] = None
+        self.rows_processed = 0
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def info(self) -> JobInfo:
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished if self.finished is not None else time.monotonic()) - self.started
+        return JobInfo(
+            Id=self.id,
+            Name=self.name,
+            Status=self.status,
+            Phase=self.phase,
+            RowsProcessed=self.rows_processed,
+            CreatedAt=self.created_at,
+            StartedAt=self.started_at,
+            FinishedAt=self.finished_at,
+            ElapsedSeconds=round(elapsed, 3),
+            Error=self.error
+        )
+
+# job in esecuzione nel task corrente, usato da set_phase/add_rows
+current_job: ContextVar[Optional[JobState]] = ContextVar('current_job', default=None)
+
+# Stato dei job e vincolo "un solo run per job" vivono nella memoria del processo:
+# con più worker un secondo POST su un altro worker avvierebbe un sync doppio e
+# /job/status risponderebbe 404. Il servizio va quindi avviato con un solo worker
+# (gunicorn -w 1), controllato all'avvio tramite WEB_CONCURRENCY.
+class JobRunner:
+    def __init__(self):
+        self.jobs: OrderedDict[str, JobState] = OrderedDict()
+        self.tasks: dict[str, asyncio.Task] = {}
+        # nome job -> id del run attivo: un solo run per job alla volta
+        self.active: dict[str, str] = {}
+        self.history_size = int(os.getenv("JOB_HISTORY_SIZE", "50"))
+
+    @staticmethod
+    def ensure_single_worker():
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        if workers > 1:
+            raise RuntimeError(f"WEB_CONCURRENCY={workers}: i job di sincronizzazione richiedono un solo worker")
+
+    def submit(self, name: str, job: Callable[[], Awaitable]) -> JobInfo:
+        active_id = self.active.get(name)
+        if active_id is not None:
+            return self.jobs[active_id].info()
+
+        state = JobState(name)
+        self.jobs[state.id] = state
+        self.active[name] = state.id
+        self.tasks[state.id] = asyncio.create_task(self._run(state, job))
+        self._trim_history()
+        return state.info()
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        state = self.jobs.get(job_id)
+        return state.info() if state else None
+
+    def list_jobs(self) -> list[JobInfo]:
+        return [state.info() for state in reversed(self.jobs.values())]
+
+    def cancel(self, job_id: str) -> Optional[JobInfo]:
+        state = self.jobs.get(job_id)
+        if state is None:
+            return None
+        task = self.tasks.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+        return state.info()
+
+    async def shutdown(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, state: JobState, job: Callable[[], Awaitable]):
+        current_job.set(state)
+        state.status = JobStatus.Running
+        state.started_at = datetime.now()
+        state.started = time.monotonic()
+        try:
+            await job()
+            state.status = JobStatus.Completed
+        except asyncio.CancelledError:
+            state.status = JobStatus.Cancelled
+        except Exception as e:
+            state.status = JobStatus.Failed
+            state.error = getattr(e, 'detail', None) or str(e)
+            print(f"Job {state.name} ({state.id}) fallito: {state.error}")
+        finally:
+            state.finished_at = datetime.now()
+            state.finished = time.monotonic()
+            job_runs.inc(job=state.name, status=state.status.value)
+            job_duration.observe(state.finished - state.started, job=state.name)
+            self.tasks.pop(state.id, None)
+            if self.active.get(state.name) == state.id:
+                del self.active[state.name]
+
+    def _trim_history(self):
+        # tengo solo gli ultimi N job terminati
+        while len(self.jobs) > self.history_size:
+            oldest = next((job_id for job_id in self.jobs if job_id not in self.tasks), None)
+            if oldest is None:
+                break
+            del self.jobs[oldest]
+
+def _job_name() -> str:
+    state = current_job.get()
+    return state.name if state is not None else 'manual'
+
+def set_phase(phase: str):
+    state = current_job.get()
+    if state is not None:
+        state.phase = phase
+
+# Misura una fase del job (fetch da Wellness, load da supabase, parse, diff, write): durata ed eventuali errori
+@contextmanager
+def job_phase(phase: str):
+    set_phase(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        job_errors.inc(job=_job_name(), phase=phase)
+        raise
+    finally:
+        job_phase_duration.observe(time.perf_counter() - start, job=_job_name(), phase=phase)
+
+def add_rows(count: int):
+    # righe ricevute da Wellness: avanzamento del job e metrica della fase fetch
+    state = current_job.get()
+    if state is not None:
+        state.rows_processed += count
+    job_rows.inc(count, job=_job_name(), phase='fetch')
+
+def record_rows(phase: str, count: int):
+    job_rows.inc(count, job=_job_name(), phase=phase)
+
+def record_bytes(count: int):
+    job_bytes.inc(count, job=_job_name())
+
+# Avvolge uno stream di righe misurando l'attesa di ogni blocco come fase fetch
+async def timed_batches(batches: AsyncIterator[list[dict]]) -> AsyncIterator[list[dict]]:
+    while True:
+        with job_phase('fetch'):
+            rows = await anext(batches, None)
+        if rows is None:
+            return
+        add_rows(len(rows))
+        yield rows
+
+# Apre uno stream HTTP dentro la fase fetch: l'invio della richiesta e l'attesa del
+# primo byte (il tempo della ricerca lato Wellness) contano come fetch, il corpo
+# viene poi misurato blocco per blocco da timed_batches
+@asynccontextmanager
+async def timed_stream(client, method: str, url: str, **kwargs):
+    async with AsyncExitStack() as stack:
+        with job_phase('fetch'):
+            response = await stack.enter_async_context(client.stream(method, url, **kwargs))
+        yield response
+
+# Singleton instance
+job_runner = JobRunner()
@@ -1,19 +1,24 @@
 from typing import List
-from dateutil import parser
 from fastapi import APIRouter, HTTPException
-from postgrest import CountMethod
 from fastapi import status
 import os
 from dotenv import load_dotenv
-import httpx
-from models.customerResponse import CustomerItem
-from models.models import Subscription, Consultant, Customer, IdModel
-from models.salesResponse import SalesResponse
+from models.customerResponse import CustomerSyncItem
+from models.models import Subscription, Consultant, CustomerSyncState, IdModel, JobInfo
+from models.salesResponse import SalesSyncItem
 from models.setmodels import CustomerRequest, CustomerSubscriptionRequest, SubscriptionRequest
 from models.domainResponse import DomainResponse
 from .auth_manager import auth_manager
-from database import supabase
-from collections import Counter
+from .auth import invalidate_consultant_cache
+from .job_runner import job_runner, job_phase, timed_batches, timed_stream, add_rows, record_rows, record_bytes
+from database import supabase, execute, bulk_upsert, select_all
+from response_cache import response_cache
+from reference_data import reference_data, normalize_package_name
+from card_summary import card_summary_store
+from http_client import get_http_client
+from dataset_stream import iter_dataset_batches
+import asyncio
+import hashlib
 import json
 
 load_dotenv()
@@ -23,13 +28,14 @@ usr: str = os.getenv("USN")
 psw: str = os.getenv("PSW")
 activity_sales: list[int]=json.loads(os.getenv("ACTIVITY_SALES", "[]"))
 days_range:int = int(os.getenv("DAYS_RANGE"))
-# Timeout personalizzato
-timeout = httpx.Timeout(
-    connect=10.0,  # Tempo per connettersi
-    read=60.0,  # Tempo per leggere la risposta
-    write=10.0,  # Tempo per scrivere
-    pool=10.0  # Tempo per ottenere connessione dal pool
-)
+# Numero massimo di chiamate Wellness contemporanee per job
+job_concurrency: int = int(os.getenv("JOB_CONCURRENCY", "4"))
+# Orizzonte in giorni delle autorizzazioni da sincronizzare
+authorizations_horizon_days: int = int(os.getenv("AUTHORIZATIONS_HORIZON_DAYS", "450"))
+# Righe Wellness lette dallo stream prima di passare a confronto e upsert
+stream_batch_size: int = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# Id per ogni filtro in_ nelle letture di confronto (limite di lunghezza dell'url)
+lookup_chunk_size: int = int(os.getenv("LOOKUP_CHUNK_SIZE", "200"))
 router = APIRouter(
     prefix='/job',
     tags=['job']
@@ -39,20 +45,64 @@ router = APIRouter(
 # si da un anno a sta parte le schede, quando un abbonamento non ha schede attive elimino
 # personal training? ogni quanto?
 
+# I job girano in background: gli endpoint restituiscono subito l'id del job,
+# lo stato si legge da /job/status/{job_id}
+
 # TODO: da decidere ogni quanto devono aggiornarsi, ogni MESE?
-@router.post('/user', status_code=status.HTTP_204_NO_CONTENT)
+@router.post('/user', status_code=status.HTTP_202_ACCEPTED, response_model=JobInfo)
 async def create_users():
-    token = await auth_manager.get_token(usr, psw)
-    api_url = f"{curling}{company}/Analysis/consultant"
-    async with httpx.AsyncClient() as client:
+    return job_runner.submit('user', sync_users)
+
+# TODO: da decidere ogni quanto devono aggiornarsi, ogni GIORNO?
+@router.post('/customer', status_code=status.HTTP_202_ACCEPTED, response_model=JobInfo)
+async def create_customers():
+    return job_runner.submit('customer', sync_customers)
+
+# TODO: da decidere ogni quanto devono aggiornarsi, ogni MESE?
+@router.post('/subscription', status_code=status.HTTP_202_ACCEPTED, response_model=JobInfo)
+async def create_subscriptions():
+    return job_runner.submit('subscription', sync_subscriptions)
+
+# TODO: da decidere ogni quanto devono aggiornarsi, ogni GIORNO?
+@router.post('/customer/subscription', status_code=status.HTTP_202_ACCEPTED, response_model=JobInfo)
+async def create_customer_subscription():
+    return job_runner.submit('customer_subscription', sync_customer_subscriptions)
+
+@router.get('/status', status_code=status.HTTP_200_OK, response_model=list[JobInfo])
+async def list_jobs():
+    return job_runner.list_jobs()
+
+@router.get('/status/{job_id}', status_code=status.HTTP_200_OK, response_model=JobInfo)
+async def get_job(job_id: str):
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job non trovato')
+    return job
+
+@router.delete('/{job_id}', status_code=status.HTTP_202_ACCEPTED, response_model=JobInfo)
+async def cancel_job(job_id: str):
+    job = job_runner.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job non trovato')
+    return job
+
+async def sync_users():
+    with job_phase('fetch'):
+        token = await auth_manager.get_token(usr, psw)
+        api_url = f"{curling}{company}/Analysis/consultant"
+        client = get_http_client()
         response = await client.get(
             api_url,
             headers={"Authorization": f"Bearer {token}"}
         )
+        record_bytes(response.num_bytes_downloaded)
 
-        if response.status_code == status.HTTP_200_OK:
+    if response.status_code == status.HTTP_200_OK:
+        with job_phase('parse'):
             users_item = DomainResponse(**response.json())
-            active_subs: List[dict] = []
+        add_rows(sum(len(group.items) for group in users_item.data.itemsGroups))
+        active_subs: List[dict] = []
+        with job_phase('diff'):
             for group in users_item.data.itemsGroups:
                 for item in group.items:
                     if item.active:
@@ -64,95 +114,123 @@ async def create_users():
                             ).model_dump()
                         )
 
-            if active_subs:
-                result = supabase.table('User').upsert(
-                    active_subs,
-                    on_conflict='IdWinC',
-                    count=CountMethod.exact
-                ).execute()
-                total_affected = len(result.data) if result.data else len(active_subs)
-                print(f"Upsert completato: {total_affected} record processati")
-        else:
+        record_rows('diff', len(active_subs))
+        if active_subs:
+            with job_phase('write'):
+                total_affected = await bulk_upsert('User', active_subs, on_conflict='IdWinC')
+            record_rows('write', total_affected)
+            print(f"Upsert completato: {total_affected} record processati")
+            invalidate_consultant_cache()
+    else:
+        with job_phase('fetch'):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials'
             )
 
-# TODO: da decidere ogni quanto devono aggiornarsi, ogni GIORNO?
-@router.post('/customer', status_code=status.HTTP_204_NO_CONTENT)
-async def create_customers():
-    token = await auth_manager.get_token(usr, psw)
-    api_url = f"{curling}{company}/analysis/analysis_customers/search"
-    async with httpx.AsyncClient(timeout=timeout) as client:
+async def sync_customers():
+    with job_phase('fetch'):
+        token = await auth_manager.get_token(usr, psw)
+        api_url = f"{curling}{company}/analysis/analysis_customers/search"
+        client = get_http_client()
+    # letture da supabase: fase a parte, fetch è solo lo scaricamento da Wellness
+    with job_phase('load'):
         all_users: list[IdModel] = await find_all_db_users_id()
+        # carico i clienti una sola volta per tutto il job, indicizzati per IdWinC
+        all_customers: dict[int, CustomerSyncState] = await find_all_db_customers()
 
-        for user in all_users:
-            response = await client.post(
-                api_url,
-                headers={"Authorization": f"Bearer {token}"},
-                json={
-                    # TODO: for IdWinC per ogni consulente? mi sa di si...
-                    # e quelli senza consulente???
-                        #"trainingReferenceOperatorIds": [8],
-                        "mainReferenceOperatorIds": [user.IdWinC],
-                        "customerStatus": 1,
-                        "analysisClassName": "FliptonicAppDb.ViewModels.Analysis.Customers.CustomersStatsSearch",
-                        "analysisResultMode": 0,
-                        "exportCsv": False,
-                        "analysisController": "Analysis_Customers"
-                    }
-            )
-            await save_customer(response, user)
+    async def sync_consultant(user: IdModel):
+        # ogni consulente fa fetch, confronto e upsert in autonomia:
+        # mentre uno scrive su supabase gli altri stanno già scaricando
+        async with timed_stream(
+            client,
+            'POST',
+            api_url,
+            headers={"Authorization": f"Bearer {token}"},
+            json={
+                # TODO: for IdWinC per ogni consulente? mi sa di si...
+                # e quelli senza consulente???
+                    #"trainingReferenceOperatorIds": [8],
+                    "mainReferenceOperatorIds": [user.IdWinC],
+                    "customerStatus": 1,
+                    "analysisClassName": "FliptonicAppDb.ViewModels.Analysis.Customers.CustomersStatsSearch",
+                    "analysisResultMode": 0,
+                    "exportCsv": False,
+                    "analysisController": "Analysis_Customers"
+                }
+        ) as response:
+            await save_customer(response, user, all_customers)
+
+    try:
+        await run_bounded([sync_consultant(user) for user in all_users], job_concurrency)
+    finally:
+        # anche se il job si interrompe una parte dei clienti può essere già stata scritta
+        response_cache.invalidate('dashboard', 'detail')
 
-async def save_customer(response, user: IdModel):
+async def save_customer(response, user: IdModel, all_customers: dict[int, CustomerSyncState]):
     if response.status_code == status.HTTP_200_OK:
-        all_customers: list[Customer] = await find_all_db_customers()
         # se son clienti nuovi inserisco
         # se ce li ho già e hanno qualche campo diverso allora aggiorno solo i campi necessari
-        to_create: List[dict] = []
-        customers_item = CustomerItem(**response.json())
-        print(f"init saving data for {user.IdWinC}: {len(customers_item.data.dataSet)}")
-        for item in customers_item.data.dataSet:
-            customer: Customer | None = next((c for c in all_customers if int(c.IdWinC) == item.customerId), None) if len(all_customers) > 0 else None
-            if customer is None or((item.customerLastAccess and parser.parse(item.customerLastAccess).date() != customer.LastAccessDate) or (item.medicalCertificateValidity and parser.parse(item.medicalCertificateValidity).date() != customer.MedicalCertificateValidity)):
-                to_create.append(
-                    CustomerRequest(
-                        Enabled=True,
-                        IdWinC=item.customerId,
-                        BirthDate=item.dateOfBirth,
-                        LastAccessDate=item.customerLastAccess,
-                        # TODO: se si aggiorna anche questo allora lascio senza if??
-                        TrainingOperatorId= customer.TrainingOperatorId if customer is not None else (item.trainingReferenceOperatorId if item.trainingReferenceOperatorId is not None else 1),
-                        Name=item.customerName,
-                        MedicalCertificateValidity=item.medicalCertificateValidity
-                    ).model_dump()
-                )
+        # le righe arrivano a blocchi dallo stream: confronto e upsert blocco per blocco
+        total_rows = 0
+        async for rows in timed_batches(iter_dataset_batches(response, stream_batch_size)):
+            total_rows += len(rows)
+            with job_phase('parse'):
+                items = [CustomerSyncItem.model_validate(row) for row in rows]
 
-        if to_create:
-            result = supabase.table('Customer').upsert(
-                to_create,
-                on_conflict='IdWinC',
-                count=CountMethod.exact
-            ).execute()
-            total_affected = len(result.data) if result.data else len(to_create)
-            print(f"Upsert completato: {total_affected} record processati")
+            to_create: List[dict] = []
+            with job_phase('diff'):
+                for item in items:
+                    customer: CustomerSyncState | None = all_customers.get(item.customerId)
+                    # se l'impronta dei campi sincronizzati non è cambiata salto la riga
+                    fingerprint = customer_fingerprint(item)
+                    if customer is None or customer.SyncHash != fingerprint:
+                        to_create.append(
+                            CustomerRequest(
+                                Enabled=True,
+                                IdWinC=item.customerId,
+                                BirthDate=item.dateOfBirth,
+                                LastAccessDate=item.customerLastAccess,
+                                # TODO: se si aggiorna anche questo allora lascio senza if??
+                                TrainingOperatorId= customer.TrainingOperatorId if customer is not None else (item.trainingReferenceOperatorId if item.trainingReferenceOperatorId is not None else 1),
+                                Name=item.customerName,
+                                MedicalCertificateValidity=item.medicalCertificateValidity,
+                                SyncHash=fingerprint
+                            ).model_dump()
+                        )
+            record_rows('diff', len(to_create))
+
+            if to_create:
+                with job_phase('write'):
+                    total_affected = await bulk_upsert('Customer', to_create, on_conflict='IdWinC')
+                record_rows('write', total_affected)
+                print(f"Upsert completato: {total_affected} record processati")
+                # un cliente può comparire sotto più consulenti: aggiorno lo stato già caricato
+                for created in to_create:
+                    all_customers[created['IdWinC']] = CustomerSyncState(**created)
+        record_bytes(response.num_bytes_downloaded)
+        print(f"saved data for {user.IdWinC}: {total_rows}")
 
     else:
         # TODO: inviare mail al servicecff
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials'
-        )
+        with job_phase('fetch'):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials'
+            )
 
-# TODO: da decidere ogni quanto devono aggiornarsi, ogni MESE?
-@router.post('/subscription', status_code=status.HTTP_201_CREATED)
-async def create_subscriptions():
-    token = await auth_manager.get_token(usr, psw)
-    api_url = f"{curling}{company}/Analysis/packages"
-    async with httpx.AsyncClient() as client:
+async def sync_subscriptions():
+    with job_phase('fetch'):
+        token = await auth_manager.get_token(usr, psw)
+        api_url = f"{curling}{company}/Analysis/packages"
+        client = get_http_client()
         response = await client.get(api_url, headers={"Authorization": f"Bearer {token}"})
+        record_bytes(response.num_bytes_downloaded)
 
-        if response.status_code == status.HTTP_200_OK:
+    if response.status_code == status.HTTP_200_OK:
+        with job_phase('parse'):
             subscriptions_item = DomainResponse(**response.json())
-            to_create: List[dict] = []
+        add_rows(sum(len(group.items) for group in subscriptions_item.data.itemsGroups))
+        to_create: List[dict] = []
+        with job_phase('diff'):
             for group in subscriptions_item.data.itemsGroups:
                 for item in group.items:
                     to_create.append(
@@ -163,21 +241,19 @@ async def create_subscriptions():
                         ).model_dump()
                     )
 
-            if to_create:
-                result = supabase.table('Subscription').upsert(
-                    to_create,
-                    on_conflict='IdWinC',
-                    count=CountMethod.exact
-                ).execute()
-                total_affected = len(result.data) if result.data else len(to_create)
-                print(f"Upsert completato: {total_affected} record processati")
-        else:
+        record_rows('diff', len(to_create))
+        if to_create:
+            with job_phase('write'):
+                total_affected = await bulk_upsert('Subscription', to_create, on_conflict='IdWinC')
+            record_rows('write', total_affected)
+            print(f"Upsert completato: {total_affected} record processati")
+            await reference_data.reload_subscriptions()
+    else:
+        with job_phase('fetch'):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials'
             )
-    return {"status": "ok"}
 
-# TODO: da decidere ogni quanto devono aggiornarsi, ogni GIORNO?
 ''' analysis_sales
                 "saleDate_range_start": "2025-01-01T00:00:00",
                 "saleDate_range_end": "2025-02-28T00:00:00",
@@ -185,89 +261,148 @@ async def create_subscriptions():
                 "activityTypeIds": activity_sales,
                 "subscriptionPeriodEnd_range_start": "2026-02-04",
 '''
-@router.post('/customer/subscription', status_code=status.HTTP_204_NO_CONTENT)
-async def create_customer_subscription():
-    token = await auth_manager.get_token(usr, psw)
-    api_url = f"{curling}{company}/analysis/analysis_authorizations/search"
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        days = 0
-        while days < 450:
-            response = await client.post(
-                api_url,
-                headers={"Authorization": f"Bearer {token}"},
-                json={
-                    "activityTypeIds": activity_sales,
-                    "authEnd_range_start_days_delta": days,
-                    "authEnd_range_end_days_delta": 450,
-                    "analysisClassName": "FliptonicAppDb.ViewModels.Analysis.Authorizations.AuthorizationExpirationStatsSearch",
-                    "analysisResultMode": 0,
-                    "customerStatus": 1,
-                    "excludeAccessCountAuthorizations": False,
-                    "includeAuthorizationsWithoutExpirationDate": False,
-                    "exportCsv": False,
-                    "analysisController": "Analysis_Authorizations"
-                }
-            )
+async def sync_customer_subscriptions():
+    with job_phase('fetch'):
+        token = await auth_manager.get_token(usr, psw)
+        api_url = f"{curling}{company}/analysis/analysis_authorizations/search"
+        client = get_http_client()
+    with job_phase('load'):
+        # catalogo già in memoria, ricaricato dal job degli abbonamenti
+        subscriptions: dict[str, Subscription] = await reference_data.get_subscription_index()
+    # le finestre condividono solo il giorno di confine: deduplico per saleId
+    to_create: dict[int, dict] = {}
 
+    async def fetch_window(start_days: int, end_days: int):
+        async with timed_stream(
+            client,
+            'POST',
+            api_url,
+            headers={"Authorization": f"Bearer {token}"},
+            json={
+                "activityTypeIds": activity_sales,
+                "authEnd_range_start_days_delta": start_days,
+                "authEnd_range_end_days_delta": end_days,
+                "analysisClassName": "FliptonicAppDb.ViewModels.Analysis.Authorizations.AuthorizationExpirationStatsSearch",
+                "analysisResultMode": 0,
+                "customerStatus": 1,
+                "excludeAccessCountAuthorizations": False,
+                "includeAuthorizationsWithoutExpirationDate": False,
+                "exportCsv": False,
+                "analysisController": "Analysis_Authorizations"
+            }
+        ) as response:
             if response.status_code == status.HTTP_200_OK:
-                sales_item = SalesResponse(**response.json())
-                to_create: list[dict] = []
-                subscriptions = await find_all_db_subscriptions()
-
-                for item in sales_item.data.dataSet:
-                    subscription: Subscription | None = next((c for c in subscriptions if c.Description == item.renewalSalePackageName or c.Description == item.salePackageName),
-                                                     None) if len(subscriptions) > 0 else None
-                    #todo: capire come fare a prendere con main operator a null
-                    if subscription and item.mainReferenceOperatorId:
-                        to_create.append(
-                            CustomerSubscriptionRequest(
-                                CustomerId= item.customerId,
-                                IdWinC=item.saleId,
-                                CreatedAt=item.saleDate,
-                                EndDate=item.end,
-                                StartDate=item.start,
-                                SubscriptionId=subscription.IdWinC,
-                                Renewed=item.renewed,
-                            ).model_dump()
-                        )
-                    else:
-                        print(f'sub name: {item.renewalSalePackageName} sale pkg name: {item.salePackageName}')
-
-                ids = [item.get("IdWinC") for item in to_create]
-                print(f"Duplicates (days {days}): {[id for id, count in Counter(ids).items() if count > 1]}")
-
-                if to_create:
-                    result = supabase.table('CustomerSubscription').upsert(
-                        to_create,
-                        on_conflict='IdWinC',
-                        count=CountMethod.exact
-                    ).execute()
-                    total_affected = len(result.data) if result.data else len(to_create)
-                    print(f"Upsert completato: {total_affected} record processati")
-                    days += days_range
+                # tengo in memoria solo la richiesta compatta, non la riga Wellness completa
+                async for rows in timed_batches(iter_dataset_batches(response, stream_batch_size)):
+                    with job_phase('parse'):
+                        items = [SalesSyncItem.model_validate(row) for row in rows]
+
+                    with job_phase('diff'):
+                        for item in items:
+                            subscription: Subscription | None = subscriptions.get(normalize_package_name(item.renewalSalePackageName)) \
+                                or subscriptions.get(normalize_package_name(item.salePackageName))
+                            #todo: capire come fare a prendere con main operator a null
+                            if subscription and item.mainReferenceOperatorId:
+                                to_create[item.saleId] = CustomerSubscriptionRequest(
+                                    CustomerId= item.customerId,
+                                    IdWinC=item.saleId,
+                                    CreatedAt=item.saleDate,
+                                    EndDate=item.end,
+                                    StartDate=item.start,
+                                    SubscriptionId=subscription.IdWinC,
+                                    Renewed=item.renewed,
+                                ).model_dump()
+                            else:
+                                print(f'sub name: {item.renewalSalePackageName} sale pkg name: {item.salePackageName}')
+                record_bytes(response.num_bytes_downloaded)
             else:
-                raise HTTPException(
-                    status_code=response.status_code, detail=response.json().get("message")
-                )
+                # risposta di errore Wellness: conta come errore della fase fetch
+                with job_phase('fetch'):
+                    await response.aread()
+                    raise HTTPException(
+                        status_code=response.status_code, detail=response.json().get("message")
+                    )
+
+    # finestre disgiunte di DAYS_RANGE giorni fino all'orizzonte, scaricate in parallelo
+    windows = [(days, min(days + days_range, authorizations_horizon_days))
+               for days in range(0, authorizations_horizon_days, days_range)]
+    await run_bounded([fetch_window(start, end) for start, end in windows], job_concurrency)
+
+    record_rows('diff', len(to_create))
+    if to_create:
+        with job_phase('load'):
+            # Renewed e SubscriptionId (scope MDS) entrano nel riepilogo delle schede collegate:
+            # ricalcolo solo i mesi delle schede degli abbonamenti già salvati che cambiano
+            saved = await find_db_customer_subscriptions(list(to_create))
+            changed = [sale_id for sale_id, row in to_create.items()
+                       if sale_id in saved and (saved[sale_id]['Renewed'], saved[sale_id]['SubscriptionId']) != (row['Renewed'], row['SubscriptionId'])]
+            card_months = await find_db_card_months(changed)
+        with job_phase('write'):
+            try:
+                total_affected = await bulk_upsert('CustomerSubscription', list(to_create.values()), on_conflict='IdWinC')
+            finally:
+                await card_summary_store.invalidate_cells(card_months)
+                response_cache.invalidate('dashboard', 'detail', 'summary')
+        record_rows('write', total_affected)
+        print(f"Upsert completato: {total_affected} record processati")
+
+async def run_bounded(coros: list, limit: int) -> list:
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    tasks = [asyncio.create_task(bounded(coro)) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # al primo errore fermo anche gli altri task, così il job non continua a metà
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
 async def find_all_db_users_id() ->  list[IdModel]:
-    users_db = supabase.table("User") \
+    users_db = await select_all(lambda: supabase.table("User") \
         .select("IdWinC") \
-        .execute()
+        .order("IdWinC"))
+
+    return [IdModel(**item) for item in users_db]
+
+async def find_all_db_customers() ->  dict[int, CustomerSyncState]:
+    customers_db = await select_all(lambda: supabase.table("Customer") \
+        .select("IdWinC, TrainingOperatorId, SyncHash") \
+        .order("IdWinC"))
+
+    return {int(item['IdWinC']): CustomerSyncState(**item) for item in customers_db}
 
-    return [IdModel(**item) for item in users_db.data]
+async def find_db_customer_subscriptions(ids: list[int]) -> dict[int, dict]:
+    async def find_chunk(chunk: list[int]):
+        return await execute(supabase.table("CustomerSubscription") \
+            .select("IdWinC, Renewed, SubscriptionId") \
+            .in_("IdWinC", chunk))
 
-async def find_all_db_customers() ->  list[Customer]:
-    customers_db = supabase.table("Customer") \
-        .select("*") \
-        .execute()
+    chunks = [ids[i:i + lookup_chunk_size] for i in range(0, len(ids), lookup_chunk_size)]
+    responses = await run_bounded([find_chunk(chunk) for chunk in chunks], job_concurrency)
+    return {int(item['IdWinC']): item for response in responses for item in response.data}
 
-    return [Customer(**item) for item in customers_db.data]
+async def find_db_card_months(subscription_ids: list[int]) -> list[tuple[int, str]]:
+    # Card.CustomerSubscriptionId è l'IdWinC della vendita
+    async def find_chunk(chunk: list[int]):
+        return await execute(supabase.table("Card") \
+            .select("TrainingOperatorId, DateStart") \
+            .in_("CustomerSubscriptionId", chunk))
 
-async def find_all_db_subscriptions() ->  list[Subscription]:
-    subscriptions_db = supabase.table("Subscription") \
-        .select("*") \
-        .eq('ValidAsSubscription', True)\
-        .execute()
+    chunks = [subscription_ids[i:i + lookup_chunk_size] for i in range(0, len(subscription_ids), lookup_chunk_size)]
+    responses = await run_bounded([find_chunk(chunk) for chunk in chunks], job_concurrency)
+    return [(item['TrainingOperatorId'], item['DateStart']) for response in responses for item in response.data]
 
-    return [Subscription(**item) for item in subscriptions_db.data]
\ No newline at end of file
+# L'impronta è salvata su Customer e confrontata al giro successivo: se non cambia
+# la riga non viene riscritta. Se manca (clienti mai sincronizzati) la riga viene scritta.
+#
+# alter table "Customer" add column "SyncHash" text;
+def customer_fingerprint(item: CustomerSyncItem) -> str:
+    # impronta dei soli campi che il job scrive su Customer
+    values = (item.customerId, item.customerName, item.dateOfBirth, item.customerLastAccess, item.medicalCertificateValidity)
+    return hashlib.blake2b('\x1f'.join('' if v is None else str(v) for v in values).encode(), digest_size=8).hexdigest()
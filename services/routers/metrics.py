@@ -0,0 +1,12 @@
+from fastapi import status, APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import registry
+
+router = APIRouter(
+    prefix='/metrics',
+    tags=['metrics']
+)
+
+@router.get('/', status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
@@ -1,3 +1,4 @@
+import asyncio
 from typing import Annotated
 from fastapi import HTTPException, status, Depends, APIRouter
 from models.models import CustomerPTActiveModel, CustomerPTModel, PackageHistoryModel, SessionPTHistoryModel
@@ -5,7 +6,10 @@ from models.setmodels import PTRequest, PTUpgradeRequest, PTUpgrade, SessionPT,
     DeleteSessionRequest
 from routers.auth import get_current_user
 from dotenv import load_dotenv
-from database import supabase
+from database import supabase, execute
+from response_cache import response_cache
+from reference_data import reference_data
+from card_summary import card_summary_store
 
 load_dotenv()
 user_dependency = Annotated[dict, Depends(get_current_user)]
@@ -20,13 +24,7 @@ async def get_session_type(user: user_dependency):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        response = supabase.table('SessionPTType')\
-            .select('*')\
-            .eq('Enabled', True)\
-            .order('SessionNumber',desc=False)\
-            .execute()
-
-        return response.data
+        return await reference_data.get_session_types()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -35,81 +33,108 @@ async def get_active_package(user: user_dependency, customer_id: int):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        customerPTResponse = supabase.table('vw_ActiveCustomerPT')\
-            .select('*')\
-            .eq('CustomerId',customer_id)\
-            .execute()
-
-        if customerPTResponse.data and customerPTResponse.data[0]:
-            customerPT = CustomerPTModel(**customerPTResponse.data[0])
-
-            sessionHistory = supabase.table('vw_SessionPTHistory')\
-                .select('*')\
-                .eq('CustomerPTId',customerPT.Id)\
-                .execute()
-
-            integrationHistory = supabase.table('CustomerPTHistory')\
-                .select('SessionAdded, DateStart')\
-                .eq('CustomerPTId',customerPT.Id)\
-                .execute()
-
-            return CustomerPTActiveModel(
-                DateStart=customerPT.DateStart,
-                SessionHistory=[] if sessionHistory.data is None else sessionHistory.data,
-                IntegrationHistory=[] if integrationHistory.data is None else integrationHistory.data,
-                Id=customerPT.Id,
-                SessionNumber=customerPT.SessionNumber,
-                TotalSession=customerPT.TotalSession,
-                RemainingSession=customerPT.SessionNumber-customerPT.TotalSession
-            )
-        else:
-            return None
+        return await cached_active_package(user, customer_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def cached_active_package(user, customer_id: int) -> CustomerPTActiveModel | None:
+    return await response_cache.get_or_load(
+        response_cache.key('pt_active', user, customer_id),
+        get_pt_tags(customer_id),
+        lambda: load_active_package(customer_id)
+    )
+
+async def load_active_package(customer_id: int) -> CustomerPTActiveModel | None:
+    # le tre query partono insieme filtrando per cliente, senza aspettare l'Id del pacchetto:
+    # le righe degli altri pacchetti vengono scartate qui sotto
+    customerPTResponse, sessionHistory, integrationHistory = await asyncio.gather(
+        execute(supabase.table('vw_ActiveCustomerPT')\
+            .select('*')\
+            .eq('CustomerId',customer_id)),
+        execute(supabase.table('vw_SessionPTHistory')\
+            .select('*')\
+            .eq('CustomerId',customer_id)),
+        execute(supabase.table('CustomerPTHistory')\
+            .select('SessionAdded, DateStart, CustomerPTId, CustomerPT!inner(CustomerId)')\
+            .eq('CustomerPT.CustomerId',customer_id)\
+            .eq('CustomerPT.Completed', False))
+    )
+
+    if customerPTResponse.data and customerPTResponse.data[0]:
+        customerPT = CustomerPTModel(**customerPTResponse.data[0])
+
+        sessions = [row for row in sessionHistory.data or [] if row.get('CustomerPTId') == customerPT.Id]
+        integrations = [
+            {'SessionAdded': row.get('SessionAdded'), 'DateStart': row.get('DateStart')}
+            for row in integrationHistory.data or [] if row.get('CustomerPTId') == customerPT.Id
+        ]
+
+        return CustomerPTActiveModel(
+            DateStart=customerPT.DateStart,
+            SessionHistory=sessions,
+            IntegrationHistory=integrations,
+            Id=customerPT.Id,
+            SessionNumber=customerPT.SessionNumber,
+            TotalSession=customerPT.TotalSession,
+            RemainingSession=customerPT.SessionNumber-customerPT.TotalSession
+        )
+    else:
+        return None
+
 @router.get('/package/history/{customer_id}', status_code=status.HTTP_200_OK)
 async def get_history_packages(user: user_dependency, customer_id: int):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        lastSessionResponse = supabase.table('vw_SessionPTHistory')\
-                .select('*')\
-                .eq('CustomerId', customer_id)\
-                .order('DateStart',desc=True)\
-                .limit(1)\
-                .execute()
-
-        if lastSessionResponse.data and lastSessionResponse.data[0]:
-            lastSession = SessionPTHistoryModel(**lastSessionResponse.data[0])
-            customerPTResponse = supabase.table('vw_CompletedCustomerPT')\
-                .select('*')\
-                .eq('CustomerId', customer_id)\
-                .execute()
-
-            return PackageHistoryModel(
-                SessionId=lastSession.Id,
-                TrainingOperatorName=lastSession.TrainingOperatorName,
-                SessionNumber=lastSession.SessionNumber,
-                DateStart=lastSession.DateStart,
-                CanUndo=lastSession.CanUndo,
-                CustomerPTId=lastSession.CustomerPTId,
-                PackageHistory=[] if customerPTResponse.data is None else customerPTResponse.data
-            )
-        else:
-            return None
+        return await cached_history_packages(user, customer_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def cached_history_packages(user, customer_id: int) -> PackageHistoryModel | None:
+    return await response_cache.get_or_load(
+        response_cache.key('pt_history', user, customer_id),
+        get_pt_tags(customer_id),
+        lambda: load_history_packages(customer_id)
+    )
+
+async def load_history_packages(customer_id: int) -> PackageHistoryModel | None:
+    # le due query dipendono solo dal cliente: partono insieme
+    lastSessionResponse, customerPTResponse = await asyncio.gather(
+        execute(supabase.table('vw_SessionPTHistory')\
+            .select('*')\
+            .eq('CustomerId', customer_id)\
+            .order('DateStart',desc=True)\
+            .limit(1)),
+        execute(supabase.table('vw_CompletedCustomerPT')\
+            .select('*')\
+            .eq('CustomerId', customer_id))
+    )
+
+    if lastSessionResponse.data and lastSessionResponse.data[0]:
+        lastSession = SessionPTHistoryModel(**lastSessionResponse.data[0])
+
+        return PackageHistoryModel(
+            SessionId=lastSession.Id,
+            TrainingOperatorName=lastSession.TrainingOperatorName,
+            SessionNumber=lastSession.SessionNumber,
+            DateStart=lastSession.DateStart,
+            CanUndo=lastSession.CanUndo,
+            CustomerPTId=lastSession.CustomerPTId,
+            PackageHistory=[] if customerPTResponse.data is None else customerPTResponse.data
+        )
+    else:
+        return None
+
 @router.post('/package', status_code=status.HTTP_201_CREATED)
 async def create_package_pt(user: user_dependency, params: PTRequest):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        supabase.table('CustomerPT')\
+        await execute(supabase.table('CustomerPT')\
         .insert([
             params.model_dump()
-        ]) \
-        .execute()
+        ]))
+        response_cache.invalidate(f'pt:{params.CustomerId}')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -118,7 +143,7 @@ async def update_package_pt(user: user_dependency, params: PTUpgradeRequest):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        supabase.table('CustomerPTHistory')\
+        await execute(supabase.table('CustomerPTHistory')\
         .insert([
             PTUpgrade(
                 DateStart=params.DateStart,
@@ -126,15 +151,15 @@ async def update_package_pt(user: user_dependency, params: PTUpgradeRequest):
                 CustomerPTId=params.CustomerPTId,
                 SessionAdded=params.SessionAdded
             ).model_dump()
-        ]) \
-        .execute()
+        ]))
 
-        supabase.table('CustomerPT')\
+        result = await execute(supabase.table('CustomerPT')\
         .update(
             {'SessionPTTypeId': params.SessionPTTypeId}
         )\
-        .eq('Id', params.CustomerPTId)\
-        .execute()
+        .eq('Id', params.CustomerPTId))
+        if result.data:
+            response_cache.invalidate(f"pt:{result.data[0].get('CustomerId')}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -143,28 +168,29 @@ async def create_session_pt(user: user_dependency, params: SessionPTRequest):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        supabase.table('SessionPT')\
+        await execute(supabase.table('SessionPT')\
         .insert([
             SessionPT(
                 DateStart=params.DateStart,
                 TrainingOperatorId=user.get('id'),
                 CustomerPTId=params.CustomerPTId,
             ).model_dump()
-        ]) \
-        .execute()
+        ]))
 
-        customerPTResponse = supabase.table('vw_ActiveCustomerPT')\
-            .select('TotalSession','SessionNumber','Id')\
-            .eq('Id',params.CustomerPTId)\
-            .execute()
+        customerPTResponse = await execute(supabase.table('vw_ActiveCustomerPT')\
+            .select('TotalSession','SessionNumber','Id','CustomerId')\
+            .eq('Id',params.CustomerPTId))
 
         customerPT = CheckCustomerPTStatus(**customerPTResponse.data[0])
 
         if customerPT.TotalSession == customerPT.SessionNumber:
-            supabase.table('CustomerPT')\
+            await execute(supabase.table('CustomerPT')\
                 .update({'Completed': True})\
-                .eq('Id', customerPT.Id)\
-                .execute()
+                .eq('Id', customerPT.Id))
+
+        # le sessioni contano anche nel riepilogo schede del consulente
+        await card_summary_store.invalidate(user.get('id'), params.DateStart)
+        response_cache.invalidate(f"pt:{customerPTResponse.data[0].get('CustomerId')}", f"summary:{user.get('id')}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -173,14 +199,21 @@ async def delete_session_pt(user: user_dependency, params: DeleteSessionRequest)
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     try:
-        supabase.table('SessionPT')\
+        session = await execute(supabase.table('SessionPT')\
             .delete()\
-            .eq('Id', params.SessionPTId)\
-            .execute()
+            .eq('Id', params.SessionPTId))
 
-        supabase.table('CustomerPT') \
+        customerPT = await execute(supabase.table('CustomerPT') \
             .update({'Completed': False}) \
-            .eq('Id', params.CustomerPTId) \
-            .execute()
+            .eq('Id', params.CustomerPTId))
+
+        for row in session.data or []:
+            await card_summary_store.invalidate(row.get('TrainingOperatorId'), row.get('DateStart'))
+        tags = [f"summary:{row.get('TrainingOperatorId')}" for row in session.data or []]
+        tags += [f"pt:{row.get('CustomerId')}" for row in customerPT.data or []]
+        response_cache.invalidate(*tags)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def get_pt_tags(customer_id: int) -> list[str]:
+    return ['pt', f'pt:{customer_id}']